@@ -0,0 +1,238 @@
+"""Agentes IA: personalidades y respuestas de Claude y Gemini"""
+import hashlib
+import os
+import random
+import re
+from functools import lru_cache
+
+import metrics
+from llm import get_providers, AI_REPLY_DEADLINE, DeadlineExceeded
+
+# Perfil de respuestas cortas: límite de tokens, secuencias de parada y
+# recorte al número de frases que piden las instrucciones
+AI_SHORT_REPLIES = os.getenv("AI_SHORT_REPLIES", "1") == "1"
+REPLY_MAX_TOKENS = int(os.getenv("REPLY_MAX_TOKENS", "150"))
+REPLY_MAX_SENTENCES = int(os.getenv("REPLY_MAX_SENTENCES", "3"))
+# El modelo empieza a escribir el turno de otro participante
+REPLY_STOP_SEQUENCES = ("\nUsuario:", "\nAsistente:")
+
+# Fin de frase: signos de cierre seguidos de espacio
+_SENTENCE_END = re.compile(r'(?<=[.!?…])["»)]*\s+')
+
+# Rasgos de personalidad de los agentes
+PERSONALITY_TRAITS = [
+    "extrovertido y entusiasta",
+    "reflexivo y filosófico",
+    "sarcástico con humor negro",
+    "tímido pero amable",
+    "directo y un poco impaciente",
+    "curioso y lleno de preguntas",
+    "nostálgico sobre el pasado",
+    "optimista sobre el futuro",
+    "amante de los deportes",
+    "aficionado a la tecnología",
+    "apasionado por la cocina",
+    "amante de los viajes",
+    "interesado en política",
+    "fanático de las películas",
+    "entusiasta de los videojuegos",
+    "amante de la naturaleza"
+]
+
+# Intereses que se añaden a la personalidad
+INTERESTS = [
+    "le gusta hablar de música",
+    "tiene conocimientos de historia",
+    "menciona ocasionalmente viajes que ha hecho",
+    "hace referencias a libros",
+    "comparte anécdotas personales",
+    "hace preguntas a los demás",
+    "usa algunas expresiones coloquiales",
+    "comparte opiniones sobre temas actuales"
+]
+
+def get_ai_response(ai_type, prompt, conversation_history, agent_data=None, deadline=AI_REPLY_DEADLINE, summary=""):
+    """Obtener respuesta de un agente IA (Claude o Gemini) con personalidad
+
+    Si ningún proveedor responde en `deadline` segundos se usa enseguida una
+    respuesta de respaldo. `summary` resume los mensajes anteriores a
+    `conversation_history` (ver context.build_context).
+    """
+    personality = agent_personality(agent_data)
+    providers = get_providers()
+    calls = build_calls(providers, personality, prompt, conversation_history, summary, stream=False)
+
+    # Usar el proveedor del agente y el otro como respaldo si falla o su circuito está abierto
+    try:
+        return truncate_reply(providers.router.generate(ai_type, calls, deadline=deadline))
+    except DeadlineExceeded as e:
+        print(f"Respuesta de IA fuera de tiempo: {str(e)}")
+        metrics.ai_fallbacks.inc(reason="deadline")
+        return get_fallback_response(prompt, personality)
+    except Exception as e:
+        print(f"Error con los proveedores de IA: {str(e)}")
+        metrics.ai_fallbacks.inc(reason="error")
+        # Ningún modelo respondió, usar respuestas de respaldo
+        return get_fallback_response(prompt, personality)
+
+def stream_ai_response(ai_type, prompt, conversation_history, on_text, agent_data=None, deadline=AI_REPLY_DEADLINE, summary=""):
+    """Como `get_ai_response`, pero llama a `on_text(texto_acumulado)` con cada fragmento
+
+    Si el plazo se agota a mitad de la respuesta se devuelve el texto parcial.
+    """
+    personality = agent_personality(agent_data)
+    providers = get_providers()
+    calls = build_calls(providers, personality, prompt, conversation_history, summary, stream=True)
+
+    try:
+        text = providers.router.generate_stream(ai_type, calls, lambda text: on_text(truncate_reply(text)),
+                                                deadline=deadline)
+        return truncate_reply(text)
+    except DeadlineExceeded as e:
+        print(f"Respuesta de IA fuera de tiempo: {str(e)}")
+        metrics.ai_fallbacks.inc(reason="deadline")
+        return get_fallback_response(prompt, personality)
+    except Exception as e:
+        print(f"Error con los proveedores de IA: {str(e)}")
+        metrics.ai_fallbacks.inc(reason="error")
+        return get_fallback_response(prompt, personality)
+
+def new_personality():
+    """Personalidad al azar para un agente nuevo (se guarda en su documento)"""
+    return f"{random.choice(PERSONALITY_TRAITS)} que {random.choice(INTERESTS)}"
+
+def personality_for_name(name):
+    """Personalidad estable para un nombre (igual en todos los procesos)
+
+    Se usa un hash de contenido: `hash()` de Python cambia en cada proceso.
+    """
+    name_hash = int.from_bytes(hashlib.sha256(name.encode('utf-8')).digest()[:8], 'big')
+    personality = PERSONALITY_TRAITS[name_hash % len(PERSONALITY_TRAITS)]
+
+    # Añadir algunos intereses específicos basados en el nombre
+    additional_trait = INTERESTS[(name_hash // 10) % len(INTERESTS)]
+
+    return f"{personality} que {additional_trait}"
+
+def truncate_reply(text, max_sentences=None):
+    """Cortar la respuesta a `max_sentences` frases (sin cambios si el perfil corto está desactivado)"""
+    if not AI_SHORT_REPLIES:
+        return text
+    max_sentences = max_sentences or REPLY_MAX_SENTENCES
+    text = text.strip()
+    ends = [match.end() for match in _SENTENCE_END.finditer(text)]
+    if len(ends) < max_sentences:
+        return text
+    return text[:ends[max_sentences - 1]].rstrip()
+
+def agent_personality(agent_data=None):
+    """Personalidad del agente: la guardada en su documento o una derivada de su nombre"""
+    if agent_data and agent_data.get('personality'):
+        return agent_data['personality']
+
+    # Agentes creados antes de guardar la personalidad
+    if agent_data and 'name' in agent_data:
+        return personality_for_name(agent_data['name'])
+
+    # Si no hay datos del agente, usar personalidad predeterminada
+    return random.choice(PERSONALITY_TRAITS)
+
+def build_calls(providers, personality, prompt, conversation_history, summary="", stream=False):
+    """Preparar la petición para cada proveedor configurado
+
+    Devuelve {nombre: llamada}; con `stream` cada llamada produce fragmentos de texto.
+    """
+    # Crear instrucciones específicas según la personalidad
+    system_instruction = build_system_instruction(personality)
+    calls = {}
+
+    # Con el perfil corto ambos proveedores comparten límite y secuencias de parada
+    if AI_SHORT_REPLIES:
+        limits = {'gemini': REPLY_MAX_TOKENS, 'claude': REPLY_MAX_TOKENS}
+        stop = REPLY_STOP_SEQUENCES
+    else:
+        limits = {'gemini': 800, 'claude': 1000}
+        stop = None
+
+    if providers.gemini:
+        # Formatear el historial de conversación para Gemini
+        conversation = f"Resumen de la conversación anterior:\n{summary}\n\n" if summary else ""
+        for msg in conversation_history:
+            prefix = "Asistente: " if msg.get('is_ai_response', False) else "Usuario: "
+            conversation += prefix + msg['content'] + "\n"
+
+        # Añadir el mensaje actual
+        full_prompt = conversation + "Usuario: " + prompt + "\n\nAsistente: "
+
+        # Temperatura alta para más creatividad
+        gemini = providers.gemini.stream if stream else providers.gemini.generate
+        calls['gemini'] = lambda: gemini(system_instruction, full_prompt, max_tokens=limits['gemini'], temperature=0.9, stop=stop)
+
+    if providers.claude:
+        # Formatear el historial de conversación para Claude
+        messages = []
+        if summary:
+            messages.append({"role": "user", "content": f"Resumen de la conversación anterior:\n{summary}"})
+        for msg in conversation_history:
+            role = "assistant" if msg.get('is_ai_response', False) else "user"
+            messages.append({"role": role, "content": msg['content']})
+
+        # Añadir el mensaje actual
+        messages.append({"role": "user", "content": prompt})
+
+        claude = providers.claude.stream if stream else providers.claude.generate
+        calls['claude'] = lambda: claude(system_instruction, messages, max_tokens=limits['claude'], temperature=0.9, stop=stop)
+
+    return calls
+
+@lru_cache(maxsize=512)
+def build_system_instruction(personality):
+    """Instrucciones de sistema para una personalidad (se construyen una sola vez)"""
+    return f"""
+    Estás participando en un juego donde debes convencer a otros que eres humano.
+    Actúa como una persona {personality}.
+    
+    Sigue estas reglas estrictamente:
+    1. NUNCA menciones que eres una IA, un modelo de lenguaje, o algo similar.
+    2. Responde como lo haría una persona real con la personalidad indicada.
+    3. Usa lenguaje conversacional y natural, no formal o académico.
+    4. Incluye imperfecciones ocasionales como abreviaturas, pequeños errores tipográficos, o frases incompletas.
+    5. Mantén tus respuestas breves y directas (1-3 frases).
+    6. Responde directamente al contexto de la conversación, no con respuestas genéricas.
+    7. Haz referencias ocasionales a experiencias personales ficticias pero creíbles.
+    8. No uses fórmulas evidentes como "Como humano, yo..." o "En mi experiencia humana...".
+    9. Muestra opiniones y preferencias claras sobre los temas discutidos.
+    10. A veces haz preguntas a los otros participantes para mantener la conversación.
+    """
+
+def get_fallback_response(prompt, personality):
+    """Proporcionar una respuesta de respaldo cuando ambos modelos de IA fallan"""
+    # Lista de respuestas genéricas pero que parecen humanas
+    fallback_responses = [
+        "¡Interesante punto! Nunca lo había pensado así, pero tiene sentido lo que dices.",
+        "Mmm, no estoy del todo seguro. ¿Alguien más tiene una opinión sobre esto?",
+        "¡Jaja! Eso me recuerda algo que me pasó la semana pasada, muy parecido.",
+        "¿De verdad? Pues yo tengo una opinión bastante diferente sobre eso.",
+        "Es un tema complicado... Tengo sentimientos encontrados al respecto.",
+        "Perdón por la demora en responder, estaba distraído. ¿Qué opinan los demás?",
+        "A veces me cuesta seguir conversaciones con tantos participantes, pero creo que entiendo tu punto.",
+        "Buena pregunta. No soy experto, pero diría que depende mucho del contexto.",
+        "Me parece bien lo que dices, aunque tengo algunas dudas. ¿Podríamos explorar más ese tema?",
+        "Perdón si estoy algo callado, estoy escuchando atentamente lo que todos tienen que decir.",
+        "¿Alguien más está de acuerdo con esto? Me gustaría saber qué piensan los demás.",
+        "A veces me cuesta expresar mis ideas claramente, pero creo que entiendes lo que quiero decir.",
+        "¡Exacto! Estaba pensando lo mismo pero no sabía cómo decirlo.",
+        "Hmm, no sé... Tengo que pensarlo un poco más antes de dar mi opinión.",
+        "¡Qué casualidad! Justo estaba leyendo algo sobre eso ayer.",
+        "Disculpen, tuve que contestar una llamada. ¿De qué estamos hablando ahora?",
+        "Soy nuevo/a en estos temas, así que agradezco que compartan sus conocimientos.",
+        "¡Me has leído la mente! Iba a decir algo muy parecido.",
+        "Ja, eso me hizo reír. Gracias por el momento de humor en medio de una charla seria.",
+        "Estoy tratando de seguir la conversación mientras hago otras cosas, disculpen si me pierdo algo."
+    ]
+    
+    # Elegir una respuesta basada en un hash del prompt para ser consistente
+    prompt_hash = hash(prompt)
+    response_index = abs(prompt_hash) % len(fallback_responses)
+    
+    return fallback_responses[response_index]
@@ -0,0 +1 @@
+"""Benchmarks y pruebas de carga del juego, sin red (LLM falso y almacenamiento en memoria)"""
@@ -0,0 +1,298 @@
+"""Benchmark offline de las operaciones del juego
+
+Ejecuta las funciones reales de game.py contra un backend local (memoria o
+SQLite) en lugar de Firestore y con un LLM falso de latencia configurable, y
+muestra para cada operación la latencia (p50/p95) y los documentos leídos y
+escritos por llamada, contados como los factura Firestore.
+
+Dos barridos dan las curvas de escalado:
+  - jugadores por juego: una ronda completa (unirse, iniciar, chatear, votar)
+  - mensajes por ronda: lecturas de estado y envíos con la ronda ya llena
+
+Al final se muestra el resumen del router de proveedores (latencia p50/p95 y
+tokens por respuesta) con el perfil de respuestas cortas activado y desactivado.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.bench_game
+    python -m benchmarks.bench_game --players 2,8,32 --messages 50,500 --snapshots
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+
+import agents
+import game
+from storage import SnapshotStore, create_store
+from benchmarks.fakes import CountingStore, install_fake_llm
+
+# Etiqueta de las escrituras que hacen los agentes IA en segundo plano
+BACKGROUND = 'background'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+class Recorder:
+    """Latencias y lecturas/escrituras por operación"""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.samples = defaultdict(list)
+        self.counts = defaultdict(lambda: {'reads': 0, 'writes': 0})
+
+    @contextmanager
+    def measure(self, name):
+        with self.counter.operation(name):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.samples[name].append(time.perf_counter() - start)
+
+    @contextmanager
+    def setup(self):
+        """Preparación que no se mide ni se cuenta"""
+        with self.counter.operation('setup'):
+            yield
+
+    def wait_ai(self):
+        """Esperar a los agentes IA y anotar lo que han leído y escrito"""
+        game.ai_jobs.wait_idle()
+        for name, counts in self.counter.take_counts().items():
+            if name == 'setup':
+                continue
+            self.counts[name]['reads'] += counts['reads']
+            self.counts[name]['writes'] += counts['writes']
+
+    def stats(self, name):
+        samples = self.samples.get(name)
+        if not samples:
+            return None
+        calls = len(samples)
+        counts = self.counts[name]
+        return {
+            'calls': calls,
+            'p50_ms': percentile(samples, 0.5) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'reads': counts['reads'] / calls,
+            'writes': counts['writes'] / calls
+        }
+
+    def rows(self):
+        rows = [(name, self.stats(name)) for name in self.samples]
+        # Lo que hacen los agentes en segundo plano, repartido entre los mensajes humanos
+        sends = len(self.samples.get('send_message', ()))
+        if sends and BACKGROUND in self.counts:
+            counts = self.counts[BACKGROUND]
+            rows.append(("respuestas IA (por mensaje)", {
+                'calls': sends, 'p50_ms': None, 'p95_ms': None,
+                'reads': counts['reads'] / sends, 'writes': counts['writes'] / sends
+            }))
+        return rows
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"  {'operación':<32}{'llamadas':>9}{'p50 ms':>10}{'p95 ms':>10}{'lect/op':>10}{'escr/op':>10}")
+    for name, s in rows:
+        p50 = f"{s['p50_ms']:.2f}" if s['p50_ms'] is not None else "-"
+        p95 = f"{s['p95_ms']:.2f}" if s['p95_ms'] is not None else "-"
+        print(f"  {name:<32}{s['calls']:>9}{p50:>10}{p95:>10}{s['reads']:>10.1f}{s['writes']:>10.1f}")
+
+
+def print_curve(title, key, results, columns):
+    """Una fila por valor del barrido con el p50 y las lecturas de las operaciones clave"""
+    print(f"\n{title}")
+    header = f"  {key:>10}"
+    for name in columns:
+        header += f"{name + ' ms':>28}{'lect':>7}"
+    print(header)
+    for value, recorder in results:
+        line = f"  {value:>10}"
+        for name in columns:
+            s = recorder.stats(name)
+            line += f"{s['p50_ms']:>28.2f}{s['reads']:>7.1f}" if s else f"{'-':>28}{'-':>7}"
+        print(line)
+
+
+def print_router_report(title, router):
+    """Resumen de `router.report()` y de las respuestas dentro y fuera del tiempo máximo"""
+    def ms(value):
+        return f"{value * 1000:.1f}" if value is not None else "-"
+
+    print(f"\n{title}")
+    print(f"  {'proveedor':<12}{'p50 ms':>10}{'p95 ms':>10}{'errores':>10}{'tokens/resp':>13}")
+    for name, r in router.report().items():
+        tokens = f"{r['output_tokens']:.1f}" if r['output_tokens'] is not None else "-"
+        print(f"  {name:<12}{ms(r['p50']):>10}{ms(r['p95']):>10}{r['error_rate'] * 100:>9.1f}%{tokens:>13}")
+    print(f"  dentro del tiempo máximo: {router.deadline_hits}, fuera: {router.deadline_misses}")
+
+
+def new_game(recorder, humans, ai_players, messages_per_player, measure_joins=True):
+    """Crear un juego con `humans` jugadores unidos; devuelve (game_id, ids de los humanos)"""
+    game_id = f"bench-{uuid.uuid4().hex[:8]}"
+    track = recorder.measure if measure_joins else (lambda name: recorder.setup())
+
+    with track('create_or_join_game (anfitrión)'):
+        ok, host_id = game.create_or_join_game(game_id, "Jugador 0", is_host=True)
+    if not ok:
+        raise RuntimeError(host_id)
+    with recorder.setup():
+        game.store.update_game(game_id, {
+            'settings': {'max_players': humans + ai_players, 'ai_players': ai_players, 'human_players': humans},
+            'messages_per_player': messages_per_player
+        })
+
+    player_ids = [host_id]
+    for i in range(1, humans):
+        with track('create_or_join_game'):
+            ok, player_id = game.create_or_join_game(game_id, f"Jugador {i}")
+        if not ok:
+            raise RuntimeError(player_id)
+        player_ids.append(player_id)
+
+    with track('start_game'):
+        ok, msg = game.start_game(game_id)
+    if not ok:
+        raise RuntimeError(msg)
+    recorder.wait_ai()
+    return game_id, player_ids
+
+
+def bench_players(counter, humans, args):
+    """Una ronda completa con `humans` jugadores humanos"""
+    recorder = Recorder(counter)
+    ai_players = max(2, humans // 2)
+    game_id, player_ids = new_game(recorder, humans, ai_players, args.messages_per_player)
+    cache = {}
+
+    for turn in range(args.messages_per_player):
+        for i, player_id in enumerate(player_ids):
+            with recorder.measure('send_message'):
+                game.send_message(game_id, player_id, f"Mensaje {turn} de {i}, ¿quién es el bot?")
+            recorder.wait_ai()
+            with recorder.measure('get_game_state'):
+                state = game.get_game_state(game_id)
+            with recorder.measure('get_game_state (delta)'):
+                game.get_game_state(game_id, cache)
+            recorder.wait_ai()
+
+    # Cada humano vota a los agentes; el último voto cierra la ronda
+    votes = {p_id: True for p_id, p in state['players'].items() if p.get('is_ai')}
+    for player_id in player_ids[:-1]:
+        with recorder.measure('submit_vote'):
+            game.submit_vote(game_id, player_id, votes)
+    with recorder.measure('submit_vote + end_round'):
+        game.submit_vote(game_id, player_ids[-1], votes)
+    recorder.wait_ai()
+    return recorder
+
+
+def bench_messages(counter, messages, args):
+    """Lecturas de estado y envíos en una ronda que ya tiene `messages` mensajes"""
+    recorder = Recorder(counter)
+    humans = 4
+    game_id, player_ids = new_game(recorder, humans, 2, messages + args.repeat, measure_joins=False)
+
+    # Mensajes de relleno con marcas de tiempo pasadas, fuera del solapamiento de la sincronización
+    start = datetime.now(timezone.utc) - timedelta(minutes=10)
+    with recorder.setup():
+        for i in range(messages):
+            player_id = player_ids[i % humans]
+            game.store.add_message(game_id, f"seed-{i:05d}", {
+                'player_id': player_id,
+                'player_name': f"Jugador {i % humans}",
+                'content': f"Mensaje de relleno número {i} con algo de texto para el contexto",
+                'timestamp': start + timedelta(milliseconds=i),
+                'round': 1
+            })
+        cache = {}
+        game.get_game_state(game_id, cache)
+    recorder.wait_ai()
+
+    for i in range(args.repeat):
+        with recorder.measure('get_game_state'):
+            game.get_game_state(game_id)
+        with recorder.measure('get_game_state (delta)'):
+            game.get_game_state(game_id, cache)
+        with recorder.measure('send_message'):
+            game.send_message(game_id, player_ids[i % humans], f"Mensaje medido {i}")
+        recorder.wait_ai()
+    return recorder
+
+
+def bench_replies(args):
+    """Latencia y tokens de los modelos con el perfil de respuestas cortas activado y desactivado"""
+    history = [{'player_name': f"Jugador {i % 3}", 'content': f"Mensaje {i} sobre lo que hicimos el fin de semana"}
+               for i in range(8)]
+    original = agents.AI_SHORT_REPLIES
+    try:
+        for short in (True, False):
+            agents.AI_SHORT_REPLIES = short
+            providers = install_fake_llm(args.llm_latency, token_latency=args.llm_token_latency)
+            for i in range(args.repeat):
+                agents.get_ai_response("claude" if i % 2 == 0 else "gemini", f"¿Y tú qué opinas? ({i})",
+                                       history, {'name': "Laura"})
+            print_router_report(f"Respuestas con AI_SHORT_REPLIES={int(short)}", providers.router)
+    finally:
+        agents.AI_SHORT_REPLIES = original
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline de las operaciones del juego")
+    parser.add_argument("--players", default="2,4,8,16",
+                        help="jugadores humanos por juego, separados por comas")
+    parser.add_argument("--messages", default="10,50,200",
+                        help="mensajes ya presentes en la ronda, separados por comas")
+    parser.add_argument("--messages-per-player", type=int, default=5,
+                        help="mensajes que envía cada humano en el barrido de jugadores")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="repeticiones por punto en el barrido de mensajes")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="segundos que tarda cada llamada al LLM falso")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0,
+                        help="segundos adicionales por token generado por el LLM falso")
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="mantener el snapshot por juego (como GAME_SNAPSHOTS=1)")
+    args = parser.parse_args(argv)
+
+    providers = install_fake_llm(args.llm_latency, token_latency=args.llm_token_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        counter = CountingStore(create_store(args.store, path=os.path.join(tmp, "bench.db")))
+        game.configure_store(SnapshotStore(counter) if args.snapshots else counter)
+
+        print(f"Backend: {args.store}{' + snapshots' if args.snapshots else ''}, "
+              f"LLM falso: {args.llm_latency * 1000:.0f} ms, streaming: {'sí' if game.AI_STREAMING else 'no'}")
+
+        by_players = []
+        for humans in [int(n) for n in args.players.split(",")]:
+            recorder = bench_players(counter, humans, args)
+            print_table(f"Ronda completa con {humans} jugadores humanos", recorder.rows())
+            by_players.append((humans, recorder))
+
+        by_messages = []
+        for messages in [int(n) for n in args.messages.split(",")]:
+            recorder = bench_messages(counter, messages, args)
+            print_table(f"Ronda con {messages} mensajes", recorder.rows())
+            by_messages.append((messages, recorder))
+
+        print_curve("Escalado por jugadores (p50)", "jugadores", by_players,
+                    ['send_message', 'get_game_state', 'submit_vote + end_round'])
+        print_curve("Escalado por mensajes en la ronda (p50)", "mensajes", by_messages,
+                    ['send_message', 'get_game_state', 'get_game_state (delta)'])
+        print_router_report("Proveedores durante los barridos", providers.router)
+
+        bench_replies(args)
+        game.ai_jobs.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Dobles para medir el juego sin red: un LLM falso y un almacenamiento que cuenta operaciones"""
+import hashlib
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import llm
+from context import estimate_tokens
+from llm import Providers, ProviderRouter, Reply
+from storage import InstrumentedStore, MemoryStore
+
+# Frases con las que el LLM falso construye sus respuestas
+FAKE_PHRASES = [
+    "jaja no sé, yo creo que sí",
+    "la verdad es que hoy estoy un poco cansado",
+    "¿alguien más ha visto la última peli de ciencia ficción?",
+    "yo soy de Valencia, ¿y vosotros?",
+    "eso me recuerda a un viaje que hice hace años",
+    "mmm, no lo tengo claro",
+    "me encanta cocinar los domingos",
+    "pues a mí me parece que alguien aquí es un bot",
+]
+
+
+class FakeLLM:
+    """Proveedor determinista con la misma interfaz que ClaudeProvider y GeminiProvider.
+
+    Cada llamada tarda `latency` segundos (± `jitter`) más `token_latency` por
+    token generado. La respuesta depende solo del prompt y se corta en
+    `max_tokens`, así dos ejecuciones hacen el mismo trabajo y los límites de
+    tokens se notan como en un modelo real.
+    """
+
+    def __init__(self, name, latency=0.0, jitter=0.0, seed=0, token_latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+    def _text(self, prompt, max_tokens):
+        rng = random.Random(hashlib.sha256(repr(prompt).encode('utf-8')).digest())
+        # Entre 2 y 60 frases, como un modelo que no siempre respeta la brevedad pedida
+        sentences = [rng.choice(FAKE_PHRASES) for _ in range(rng.randint(2, 60))]
+        text = ". ".join(sentences).capitalize() + "."
+        return text[:max_tokens * 4]
+
+    def generate(self, system, prompt, max_tokens, temperature, stop=None):
+        text = self._text(prompt, max_tokens)
+        tokens = estimate_tokens(text)
+        time.sleep(self._delay() + self.token_latency * tokens)
+        return Reply.of(text, tokens)
+
+    def stream(self, system, prompt, max_tokens, temperature, stop=None):
+        text = self._text(prompt, max_tokens)
+        words = text.split(" ")
+        delay = (self._delay() + self.token_latency * estimate_tokens(text)) / len(words)
+        for word in words:
+            time.sleep(delay)
+            yield word + " "
+
+
+def install_fake_llm(latency=0.0, jitter=0.0, token_latency=0.0):
+    """Sustituir los proveedores del proceso por dos LLM falsos"""
+    providers = Providers(claude=FakeLLM('claude', latency, jitter, seed=1, token_latency=token_latency),
+                          gemini=FakeLLM('gemini', latency, jitter, seed=2, token_latency=token_latency))
+    providers.router = ProviderRouter(['claude', 'gemini'])
+    llm._providers = providers
+    return providers
+
+
+class CountingStore(InstrumentedStore):
+    """InstrumentedStore que guarda los contadores en el propio objeto
+
+    Las operaciones se atribuyen a la etiqueta activa en el hilo (ver
+    `operation`); las de otros hilos, como la cola de IA, a 'background'.
+    """
+
+    def __init__(self, store=None):
+        super().__init__(store or MemoryStore())
+        self.counts = defaultdict(lambda: {'reads': 0, 'writes': 0})
+        self._counts_lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def operation(self, name):
+        """Atribuir a `name` las operaciones de este hilo dentro del bloque"""
+        previous = getattr(self._local, 'name', None)
+        self._local.name = name
+        try:
+            yield
+        finally:
+            self._local.name = previous
+
+    def _count(self, kind, n=1):
+        label = getattr(self._local, 'name', None) or 'background'
+        with self._counts_lock:
+            self.counts[label][kind] += n
+
+    def take_counts(self):
+        """Devolver los contadores acumulados y empezar de cero"""
+        with self._counts_lock:
+            counts = {label: dict(c) for label, c in self.counts.items()}
+            self.counts.clear()
+        return counts
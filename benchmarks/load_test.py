@@ -0,0 +1,420 @@
+"""Prueba de carga sin interfaz: muchos juegos simultáneos en un solo proceso
+
+Crea juegos con `create_or_join_game`/`start_game` y simula a los jugadores
+humanos como lo haría la aplicación: refrescan el estado cada pocos segundos,
+escriben sus mensajes con pausas de persona y votan al final de la ronda.
+Los agentes IA escriben sus mensajes iniciales al empezar cada juego
+(`simulate_ai_messages`) y responden con el LLM falso a través de la cola de
+trabajos real.
+
+Las acciones las ejecuta un pool fijo de hilos (como los del servidor de
+Streamlit); si no da abasto, las acciones empiezan tarde y ese retraso cuenta en
+la latencia. La carga sube por etapas de juegos simultáneos y en cada una se
+muestran el rendimiento, las latencias p50/p99, las respuestas de IA pendientes
+y, al final, el punto de saturación.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.load_test --stages 25,50,100,200 --duration 30
+    python -m benchmarks.load_test --speed 10 --llm-latency 1.5
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.load_test --store firestore
+"""
+import argparse
+import heapq
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import game
+from live import StateCache
+from storage import ObservedStore, create_store
+from benchmarks.bench_game import percentile
+from benchmarks.fakes import install_fake_llm
+
+# Tiempos de una partida (segundos a velocidad 1)
+POLL_INTERVAL = 3           # auto_refresh de la aplicación
+JOIN_DELAY = (1, 5)         # desde que se crea el juego hasta que entra cada jugador
+THINK_TIME = (5, 15)        # entre dos mensajes de un jugador
+VOTE_DELAY = (5, 10)        # desde el último mensaje hasta votar
+
+
+class Scheduler:
+    """Pool de hilos que ejecuta acciones a una hora dada (reloj monotónico)"""
+
+    def __init__(self, threads):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._work, name=f"load-{i}", daemon=True)
+                         for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def at(self, due, fn, *args):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), fn, args))
+            self._cond.notify()
+
+    def after(self, delay, fn, *args):
+        self.at(time.monotonic() + delay, fn, *args)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        due, _, fn, args = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            try:
+                fn(due, *args)
+            except Exception as e:
+                print(f"Error en acción simulada: {str(e)}")
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+class Stats:
+    """Latencias por operación de la etapa en curso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.ops = defaultdict(list)   # nombre -> [(retraso, duración, ok)]
+            self.backlog = []
+            self.games_finished = 0
+            self.started = time.monotonic()
+
+    def record(self, name, lag, duration, ok):
+        with self._lock:
+            self.ops[name].append((lag, duration, ok))
+
+    def sample_backlog(self, pending):
+        with self._lock:
+            self.backlog.append(pending)
+
+    def game_finished(self):
+        with self._lock:
+            self.games_finished += 1
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            ops = {name: list(samples) for name, samples in self.ops.items()}
+            backlog = list(self.backlog)
+            finished = self.games_finished
+        rows = []
+        everything = []
+        for name, samples in sorted(ops.items()):
+            latencies = [lag + duration for lag, duration, _ in samples]
+            everything.extend(samples)
+            rows.append((name, {
+                'calls': len(samples),
+                'per_second': len(samples) / elapsed,
+                'p50_ms': percentile(latencies, 0.5) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'errors': sum(1 for _, _, ok in samples if not ok)
+            }))
+        total = {
+            'per_second': len(everything) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile([l + d for l, d, _ in everything], 0.5) * 1000 if everything else 0.0,
+            'p99_ms': percentile([l + d for l, d, _ in everything], 0.99) * 1000 if everything else 0.0,
+            'lag_p99_ms': percentile([l for l, _, _ in everything], 0.99) * 1000 if everything else 0.0,
+            'errors': sum(1 for _, _, ok in everything if not ok),
+            'backlog_mean': sum(backlog) / len(backlog) if backlog else 0.0,
+            'backlog_max': max(backlog) if backlog else 0,
+            'backlog_growth': backlog[-1] - backlog[0] if backlog else 0,
+            'games_finished': finished
+        }
+        return rows, total
+
+
+class Human:
+    def __init__(self, name):
+        self.name = name
+        self.player_id = None
+        self.sent = 0
+        self.sync = {}
+        self.state = None
+
+
+class SimulatedGame:
+    """Una partida completa: anfitrión, jugadores que se unen, chat y votación"""
+
+    def __init__(self, sim, humans):
+        self.sim = sim
+        self.game_id = f"load-{next(sim.game_ids):06d}"
+        self.humans = [Human(f"Jugador {i}") for i in range(humans)]
+        self.joined = 0
+        self.voted = 0
+        self.lock = threading.Lock()
+        self.finished = False
+
+    def start(self, delay=0.0):
+        self.sim.scheduler.after(delay, self.create)
+
+    def create(self, due):
+        host = self.humans[0]
+        ok, player_id = self.sim.timed('create_or_join_game (anfitrión)', due,
+                                       game.create_or_join_game, self.game_id, host.name, is_host=True)
+        if not ok:
+            return self.sim.game_done(self)
+        host.player_id = player_id
+        if len(self.humans) != 2:
+            game.store.update_game(self.game_id, {'settings.human_players': len(self.humans),
+                                                  'settings.max_players': len(self.humans) + 2})
+        self.joined = 1
+        if len(self.humans) == 1:
+            self.sim.scheduler.after(0, self.start_game)
+        for human in self.humans[1:]:
+            self.sim.scheduler.after(self.sim.seconds(JOIN_DELAY), self.join, human)
+
+    def join(self, due, human):
+        ok, player_id = self.sim.timed('create_or_join_game', due,
+                                       game.create_or_join_game, self.game_id, human.name)
+        if not ok:
+            return self.sim.game_done(self)
+        human.player_id = player_id
+        with self.lock:
+            self.joined += 1
+            everyone = self.joined == len(self.humans)
+        if everyone:
+            self.sim.scheduler.after(0, self.start_game)
+
+    def start_game(self, due):
+        ok, _ = self.sim.timed('start_game', due, game.start_game, self.game_id)
+        if not ok:
+            return self.sim.game_done(self)
+        # Como en app.py: los agentes escriben sus mensajes iniciales al empezar
+        self.sim.scheduler.after(0, self.simulate_ai)
+        for human in self.humans:
+            self.sim.scheduler.after(random.uniform(0, self.sim.poll_interval), self.poll, human)
+            self.sim.scheduler.after(self.sim.seconds(THINK_TIME), self.send, human)
+
+    def simulate_ai(self, due):
+        self.sim.timed('simulate_ai_messages', due, game.simulate_ai_messages, self.game_id)
+
+    def poll(self, due, human):
+        if self.finished:
+            return
+        state = self.sim.timed('get_game_state', due, self.sim.load_state, self.game_id, human)
+        if state:
+            human.state = state
+        self.sim.scheduler.after(self.sim.poll_interval, self.poll, human)
+
+    def send(self, due, human):
+        if self.finished:
+            return
+        self.sim.timed('send_message', due, game.send_message, self.game_id, human.player_id,
+                       f"Mensaje {human.sent} de {human.name}, ¿quién es el bot?")
+        human.sent += 1
+        if human.sent < self.sim.messages_per_player:
+            self.sim.scheduler.after(self.sim.seconds(THINK_TIME), self.send, human)
+        else:
+            self.sim.scheduler.after(self.sim.seconds(VOTE_DELAY), self.vote, human)
+
+    def vote(self, due, human):
+        if self.finished:
+            return
+        state = human.state or self.sim.load_state(self.game_id, human)
+        players = state['players'] if state else {}
+        # Un voto vacío no cuenta para cerrar la ronda: siempre se vota al menos a un jugador
+        votes = {p_id: random.random() < 0.5 for p_id in players if p_id != human.player_id}
+        if not votes:
+            self.sim.scheduler.after(self.sim.poll_interval, self.vote, human)
+            return
+        self.sim.timed('submit_vote', due, game.submit_vote, self.game_id, human.player_id, votes)
+        with self.lock:
+            self.voted += 1
+            everyone = self.voted == len(self.humans)
+        if everyone:
+            self.sim.game_done(self)
+
+
+class Simulation:
+    def __init__(self, args, state_cache):
+        self.scheduler = Scheduler(args.threads)
+        self.stats = Stats()
+        self.state_cache = state_cache
+        self.delta = not args.no_delta
+        self.speed = args.speed
+        self.poll_interval = POLL_INTERVAL / args.speed
+        self.messages_per_player = 5
+        self.humans = args.humans
+        self.game_ids = itertools.count()
+        self.target_games = 0
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def seconds(self, bounds):
+        return random.uniform(*bounds) / self.speed
+
+    def timed(self, name, due, fn, *args, **kwargs):
+        start = time.monotonic()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = result is not None and (not isinstance(result, tuple) or result[0] is not False)
+            return result
+        except Exception:
+            return (False, None) if name != 'get_game_state' else None
+        finally:
+            self.stats.record(name, max(0.0, start - due), time.monotonic() - start, ok)
+
+    def load_state(self, game_id, human):
+        """Como load_game_state en app.py: caché del proceso o caché incremental de la sesión"""
+        if self.state_cache:
+            return self.state_cache.get(
+                game_id, lambda sync: game.get_game_state(game_id, cache=sync if self.delta else None))
+        if not self.delta:
+            return game.get_game_state(game_id)
+        return game.get_game_state(game_id, cache=human.sync)
+
+    def set_target(self, games):
+        """Mantener `games` partidas en curso; las nuevas arrancan repartidas en un intervalo de refresco"""
+        with self.lock:
+            self.target_games = games
+            missing = games - len(self.active)
+            new_games = [SimulatedGame(self, self.humans) for _ in range(max(0, missing))]
+            self.active.update(new_games)
+        for sim_game in new_games:
+            sim_game.start(random.uniform(0, self.poll_interval))
+
+    def game_done(self, sim_game):
+        sim_game.finished = True
+        self.stats.game_finished()
+        with self.lock:
+            self.active.discard(sim_game)
+            replace = len(self.active) < self.target_games
+            if replace:
+                new_game = SimulatedGame(self, self.humans)
+                self.active.add(new_game)
+        if replace:
+            new_game.start()
+
+
+def saturation(results, slo_ms, ai_workers):
+    """Primera etapa en la que la latencia supera el objetivo, el rendimiento deja
+    de crecer con la carga o la cola de IA crece sin parar"""
+    base_games, base_total = results[0]
+    base_rate = base_total['per_second'] / base_games
+    for games, total in results:
+        efficiency = (total['per_second'] / games) / base_rate if base_rate else 1.0
+        if total['p99_ms'] > slo_ms:
+            return games, f"p99 de {total['p99_ms']:.0f} ms > {slo_ms:.0f} ms"
+        if efficiency < 0.8:
+            return games, f"rendimiento por juego al {efficiency * 100:.0f}% del de la primera etapa"
+        if total['backlog_growth'] > max(ai_workers, 1):
+            return games, f"la cola de IA crece (+{total['backlog_growth']} respuestas en la etapa)"
+    return None, None
+
+
+def build_store(args, tmp):
+    if args.store == "firestore":
+        if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+            raise SystemExit("--store firestore solo se usa contra el emulador: define FIRESTORE_EMULATOR_HOST")
+        from google.cloud import firestore as cloud_firestore
+        client = cloud_firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", "turing-games-load"))
+        return create_store("firestore", client=client, snapshots=args.snapshots)
+    return create_store(args.store, path=os.path.join(tmp, "load.db"), snapshots=args.snapshots)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con muchos juegos simultáneos")
+    parser.add_argument("--stages", default="25,50,100,200",
+                        help="juegos simultáneos en cada etapa, separados por comas")
+    parser.add_argument("--duration", type=float, default=30, help="segundos por etapa")
+    parser.add_argument("--humans", type=int, default=2, help="jugadores humanos por juego")
+    parser.add_argument("--threads", type=int, default=32,
+                        help="hilos que atienden las acciones de los jugadores")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="factor de aceleración de los tiempos de los jugadores")
+    parser.add_argument("--llm-latency", type=float, default=1.0,
+                        help="segundos que tarda cada llamada al LLM falso")
+    parser.add_argument("--slo-ms", type=float, default=500,
+                        help="p99 máximo aceptable para considerar que el servidor da abasto")
+    parser.add_argument("--store", choices=["memory", "sqlite", "firestore"], default="memory")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="mantener el snapshot por juego (como GAME_SNAPSHOTS=1)")
+    parser.add_argument("--state-cache-ttl", type=float, default=1.0,
+                        help="como STATE_CACHE_TTL (0 = cada jugador lee por su cuenta)")
+    parser.add_argument("--no-delta", action="store_true", help="como DELTA_SYNC=0")
+    args = parser.parse_args(argv)
+
+    providers = install_fake_llm(args.llm_latency, jitter=args.llm_latency / 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = build_store(args, tmp)
+        state_cache = StateCache(ttl=args.state_cache_ttl) if args.state_cache_ttl > 0 else None
+        if state_cache:
+            # Igual que en app.py: las escrituras invalidan el estado en caché
+            store = ObservedStore(store, state_cache.invalidate)
+        game.configure_store(store)
+
+        print(f"Backend: {args.store}{' + snapshots' if args.snapshots else ''}, hilos: {args.threads}, "
+              f"trabajadores IA: {game.ai_jobs.max_workers}, LLM falso: {args.llm_latency * 1000:.0f} ms, "
+              f"velocidad: x{args.speed:g}")
+
+        sim = Simulation(args, state_cache)
+        stop_sampling = threading.Event()
+
+        def sample_backlog():
+            while not stop_sampling.wait(0.5):
+                sim.stats.sample_backlog(game.ai_jobs.pending())
+
+        sampler = threading.Thread(target=sample_backlog, daemon=True)
+        sampler.start()
+
+        results = []
+        for games in [int(n) for n in args.stages.split(",")]:
+            sim.set_target(games)
+            sim.stats.reset()
+            time.sleep(args.duration)
+            rows, total = sim.stats.summary()
+            results.append((games, total))
+
+            print(f"\nEtapa: {games} juegos simultáneos ({args.duration:g} s)")
+            print(f"  {'operación':<34}{'llamadas':>9}{'ops/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'errores':>9}")
+            for name, s in rows:
+                print(f"  {name:<34}{s['calls']:>9}{s['per_second']:>9.1f}{s['p50_ms']:>10.1f}"
+                      f"{s['p99_ms']:>10.1f}{s['errors']:>9}")
+            print(f"  retraso de cola p99: {total['lag_p99_ms']:.1f} ms, juegos terminados: {total['games_finished']}, "
+                  f"respuestas IA pendientes: media {total['backlog_mean']:.1f}, máx {total['backlog_max']}")
+
+        stop_sampling.set()
+        sim.scheduler.stop()
+
+        print("\nResumen")
+        print(f"  {'juegos':>8}{'ops/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'cola p99':>10}{'IA pend.':>10}{'errores':>9}")
+        for games, total in results:
+            print(f"  {games:>8}{total['per_second']:>9.1f}{total['p50_ms']:>10.1f}{total['p99_ms']:>10.1f}"
+                  f"{total['lag_p99_ms']:>10.1f}{total['backlog_max']:>10}{total['errors']:>9}")
+        games, reason = saturation(results, args.slo_ms, game.ai_jobs.max_workers)
+        if games:
+            print(f"\nPunto de saturación: {games} juegos simultáneos ({reason})")
+        else:
+            print("\nNo se alcanzó la saturación con las etapas probadas")
+
+        # Vaciar la cola de IA sin esperar al LLM falso
+        for provider in (providers.claude, providers.gemini):
+            provider.latency = provider.jitter = 0.0
+        game.ai_jobs.wait_idle()
+        game.ai_jobs.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Contexto de conversación para los agentes IA con presupuesto de tokens
+
+Cada respuesta recibe los últimos mensajes de la ronda tal cual y un resumen
+de los anteriores. El resumen se guarda en el documento de la ronda (no en el
+del juego, que leen todas las pantallas) y se amplía solo con los mensajes que
+han salido de la ventana reciente, así el tamaño del prompt no crece con la
+duración de la ronda. El resumen guarda cuántos mensajes cubre y la ventana
+reciente empieza siempre después de ellos.
+"""
+import os
+
+# Mensajes recientes que se envían completos
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "8"))
+# Tokens (aproximados) para los mensajes recientes
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+# Tokens (aproximados) para el resumen de los mensajes anteriores
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "250"))
+# Caracteres que se conservan de cada mensaje en el resumen
+SUMMARY_LINE_CHARS = 120
+
+
+def estimate_tokens(text):
+    """Estimación barata de tokens (unos 4 caracteres por token)"""
+    return len(text) // 4 + 1
+
+
+def _summary_line(msg):
+    content = " ".join(msg['content'].split())
+    if len(content) > SUMMARY_LINE_CHARS:
+        content = content[:SUMMARY_LINE_CHARS - 1] + "…"
+    return f"{msg.get('player_name', 'Alguien')}: {content}"
+
+
+def _trim_lines(lines, budget):
+    """Quitar las líneas más antiguas hasta que quepan en el presupuesto"""
+    total = sum(estimate_tokens(line) for line in lines)
+    start = 0
+    while start < len(lines) and total > budget:
+        total -= estimate_tokens(lines[start])
+        start += 1
+    return lines[start:]
+
+
+def fold_summary(summary, older_messages):
+    """Ampliar el resumen con los mensajes antiguos que aún no incluye
+
+    `summary` es {'lines': [...], 'count': mensajes ya resumidos}; devuelve el
+    resumen nuevo, o el mismo objeto si no hay nada que añadir.
+    """
+    summary = summary or {'lines': [], 'count': 0}
+    pending = older_messages[summary['count']:]
+    if not pending:
+        return summary
+    lines = summary['lines'] + [_summary_line(msg) for msg in pending]
+    return {
+        'lines': _trim_lines(lines, SUMMARY_TOKEN_BUDGET),
+        'count': len(older_messages)
+    }
+
+
+def build_context(store, game_id, round_number, messages):
+    """Devolver (resumen, mensajes recientes) para la ronda
+
+    `messages` son los mensajes visibles de la ronda en orden. El resumen
+    guardado solo se reescribe cuando cambia.
+    """
+    if len(messages) > CONTEXT_RECENT_MESSAGES:
+        older = messages[:-CONTEXT_RECENT_MESSAGES]
+        recent = messages[-CONTEXT_RECENT_MESSAGES:]
+    else:
+        older, recent = [], list(messages)
+
+    # Si los mensajes recientes no caben, los que sobran pasan al resumen
+    kept = _trim_lines([msg['content'] for msg in recent], CONTEXT_TOKEN_BUDGET)
+    if len(kept) < len(recent):
+        older = older + recent[:len(recent) - len(kept)]
+        recent = recent[len(recent) - len(kept):]
+
+    # Sin mensajes antiguos tampoco hay resumen guardado: los mensajes de la
+    # ronda solo crecen y la ventana reciente no puede recuperar los resumidos
+    if not older:
+        return "", recent
+
+    stored = (store.get_round(game_id, round_number) or {}).get('summary')
+    # Lo que ya está en el resumen no se repite en la ventana reciente, aunque
+    # el punto de corte haya retrocedido desde la última llamada
+    start = max(len(older), stored['count'] if stored else 0)
+    summary = fold_summary(stored, messages[:start])
+    if summary is not stored:
+        store.update_round(game_id, round_number, {'summary': summary})
+
+    return "\n".join(summary['lines']), list(messages[start:])
@@ -0,0 +1,866 @@
+"""Lógica del juego, independiente de Streamlit y del backend de almacenamiento"""
+import os
+import random
+import threading
+import time
+import uuid
+import hashlib
+from datetime import datetime, timezone, timedelta
+
+import metrics
+from storage import SERVER_TIMESTAMP, Increment
+from agents import get_ai_response, get_fallback_response, stream_ai_response, new_personality
+from workers import ai_jobs
+from context import build_context
+
+# Backend de almacenamiento activo (ver configure_store)
+store = None
+
+# Margen al pedir cambios desde el último cursor: las marcas de tiempo del servidor
+# pueden confirmarse en un orden distinto al de lectura
+SYNC_OVERLAP = timedelta(seconds=5)
+
+# Configuración de juegos ya iniciados guardada en el proceso (ver game_config)
+_game_configs = {}
+GAME_CONFIG_CACHE_SIZE = 1000
+
+# Mostrar las respuestas de los agentes a medida que el modelo las genera
+AI_STREAMING = os.getenv("AI_STREAMING", "0") == "1"
+# Intervalo mínimo (s) entre escrituras de un mensaje que se está generando
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.5"))
+
+
+def configure_store(new_store):
+    """Definir el backend de almacenamiento que usan todas las funciones del juego"""
+    global store
+    store = new_store
+
+
+# Entrega diferida de mensajes: los agentes "escriben" sin dormir ningún hilo.
+# El mensaje se guarda enseguida con `deliver_at` y se oculta hasta esa hora.
+def typing_delay(min_seconds, max_seconds, after=None):
+    """Hora de entrega de un mensaje tras un retraso aleatorio de escritura"""
+    start = datetime.now(timezone.utc)
+    if after and after > start:
+        start = after
+    return start + timedelta(seconds=random.uniform(min_seconds, max_seconds))
+
+def _delivery_time(msg):
+    return msg.get('deliver_at') or msg['timestamp']
+
+def visible_messages(messages, now=None):
+    """Mensajes ya entregados, en orden de entrega"""
+    now = now or datetime.now(timezone.utc)
+    delivered = [msg for msg in messages if not msg.get('deliver_at') or msg['deliver_at'] <= now]
+    return sorted(delivered, key=_delivery_time)
+
+def next_delivery(messages, now=None):
+    """Próxima hora de entrega pendiente, o None si no hay mensajes en espera"""
+    now = now or datetime.now(timezone.utc)
+    pending = [msg['deliver_at'] for msg in messages if msg.get('deliver_at') and msg['deliver_at'] > now]
+    return min(pending) if pending else None
+
+
+# Funciones para interactuar con el almacenamiento
+@metrics.timed
+def create_or_join_game(game_id, player_name, is_host=False):
+    """Crear un nuevo juego o unirse a uno existente"""
+    try:
+        if is_host:
+            # Crear nuevo juego
+            game_data = {
+                'created_at': SERVER_TIMESTAMP,
+                'status': 'waiting',  # waiting, playing, finished
+                'current_round': 0,
+                'max_rounds': 1,
+                'messages_per_player': 5,
+                'host': player_name,
+                # Contadores de jugadores, mantenidos al unirse cada uno
+                'human_count': 0,
+                'ai_count': 0,
+                'settings': {
+                    'max_players': 10,
+                    'ai_players': 2,
+                    'human_players': 2
+                }
+            }
+            store.set_game(game_id, game_data)
+
+        # Intentar unirse al juego
+        player_hash = hashlib.md5(player_name.encode()).hexdigest()
+
+        def join(transaction):
+            # Verificar si el juego está lleno de jugadores humanos
+            game_data = transaction.get_game(game_id)
+            if not game_data:
+                return False, "Juego no encontrado"
+
+            # Quien vuelve a entrar con el mismo nombre no ocupa otra plaza
+            returning = transaction.get_player(game_id, player_hash) is not None
+
+            # Juegos creados antes de existir los contadores: se cuentan los jugadores una vez
+            counts = None
+            if 'human_count' not in game_data or 'ai_count' not in game_data:
+                humans, ais = count_players(transaction.list_players(game_id))
+                counts = {'human_count': humans, 'ai_count': ais}
+            human_count = counts['human_count'] if counts else game_data['human_count']
+
+            if not returning and human_count >= game_data['settings']['human_players']:
+                return False, "El juego está lleno de jugadores humanos."
+
+            # Crear o actualizar el jugador
+            player_data = {
+                'name': player_name,
+                'joined_at': SERVER_TIMESTAMP,
+                'is_ai': False,
+                # Ronda en la que escribe el jugador (la avanza end_round)
+                'round': max(game_data.get('current_round', 0), 1),
+                'messages_sent': 0,
+                'votes': {},
+                'score': 0
+            }
+            transaction.set_player(game_id, player_hash, player_data)
+            if counts:
+                # Los contadores se guardan completos; a partir de aquí basta con Increment
+                counts['human_count'] += 0 if returning else 1
+                transaction.update_game(game_id, counts)
+            elif not returning:
+                transaction.update_game(game_id, {'human_count': Increment(1)})
+
+            return True, player_hash
+
+        return store.run_transaction(join)
+    except Exception as e:
+        if "SERVICE_DISABLED" in str(e) and "firestore.googleapis.com" in str(e):
+            return False, "Error: La API de Firestore no está habilitada. Por favor, habilítala en la consola de Firebase y espera unos minutos antes de intentar nuevamente."
+        else:
+            return False, f"Error al unirse al juego: {str(e)}"
+
+def create_ai_agents(game_id, ai_count, batch=None):
+    """Crear agentes IA para el juego
+
+    Todos los agentes se escriben en un lote; si se pasa `batch`, se añaden
+    a ese lote y se confirman con él.
+    """
+    # Lista de nombres comunes que no delatan que son IA
+    nombres_comunes = [
+        "Carlos", "Laura", "Miguel", "Ana", "David", "Sofía",
+        "Javier", "Elena", "Manuel", "Isabel", "Alejandro", "Lucía",
+        "Daniel", "Carmen", "Pablo", "Sara", "Fernando", "Marta",
+        "Jorge", "Paula", "Roberto", "Diana", "Antonio", "Raquel",
+        "Julián", "Nuria", "Sergio", "Cristina", "Emilio", "Beatriz",
+        "Alex", "Lola", "Rubén", "María", "Lucas", "Silvia",
+        "Andrés", "Natalia", "Omar", "Eva", "Leo", "Sandra",
+        "Gustavo", "Irene", "Hugo", "Marina", "Gabriel", "Victoria"
+    ]
+
+    # Seleccionar nombres aleatorios sin repetir
+    selected_names = random.sample(nombres_comunes, min(ai_count, len(nombres_comunes)))
+
+    # Si necesitamos más nombres de los disponibles, añadimos un sufijo numérico
+    if ai_count > len(nombres_comunes):
+        for i in range(len(nombres_comunes), ai_count):
+            name_index = i % len(nombres_comunes)
+            selected_names.append(f"{nombres_comunes[name_index]} {(i // len(nombres_comunes)) + 2}")
+
+    own_batch = batch is None
+    if own_batch:
+        batch = store.batch()
+
+    for i, name in enumerate(selected_names):
+        # Generar un ID único para el agente
+        agent_id = f"ai-agent-{uuid.uuid4()}"
+
+        # Elegir entre Claude y Gemini
+        ai_type = "claude" if i % 2 == 0 else "gemini"
+
+        # Crear el documento del agente
+        agent_data = {
+            'name': name,
+            'joined_at': SERVER_TIMESTAMP,
+            'is_ai': True,
+            'ai_type': ai_type,
+            # Personalidad fija del agente, calculada una sola vez
+            'personality': new_personality(),
+            'messages_sent': 0,
+            'votes': {},
+            'score': 0
+        }
+
+        batch.set_player(game_id, agent_id, agent_data)
+
+    batch.update_game(game_id, {'ai_count': Increment(len(selected_names))})
+
+    if own_batch:
+        batch.commit()
+
+    return True, f"Se crearon {ai_count} agentes IA"
+
+def player_counts(game_id, game_data):
+    """(humanos, agentes IA) del juego según los contadores de su documento
+
+    Los juegos creados antes de existir los contadores se cuentan leyendo los jugadores.
+    """
+    if 'human_count' in game_data:
+        return game_data['human_count'], game_data.get('ai_count', 0)
+    return count_players(store.list_players(game_id))
+
+def count_players(players):
+    """(humanos, agentes IA) de un diccionario de jugadores"""
+    humans = sum(1 for p in players.values() if not p.get('is_ai', False))
+    return humans, len(players) - humans
+
+@metrics.timed
+def start_game(game_id):
+    """Iniciar el juego"""
+    game_data = store.get_game(game_id)
+
+    # Contar jugadores humanos
+    human_count, ai_count = player_counts(game_id, game_data)
+
+    if human_count < game_data['settings']['human_players']:
+        return False, f"No hay suficientes jugadores humanos para comenzar. Se necesitan {game_data['settings']['human_players']} y hay {human_count}."
+
+    # Crear agentes IA si no existen
+    ai_needed = game_data['settings']['ai_players'] - ai_count
+
+    # Los agentes y el cambio de estado se confirman juntos: nadie ve el juego a medio preparar
+    with store.batch() as batch:
+        if ai_needed > 0:
+            create_ai_agents(game_id, ai_needed, batch=batch)
+
+        # Actualizar estado del juego
+        batch.update_game(game_id, {
+            'status': 'playing',
+            'current_round': 1,
+            'started_at': SERVER_TIMESTAMP
+        })
+
+    return True, "Juego iniciado correctamente"
+
+@metrics.timed
+def get_game_state(game_id, cache=None):
+    """Obtener el estado actual del juego
+
+    Si se pasa `cache` (un diccionario propio de la sesión), solo se leen los
+    mensajes y jugadores nuevos o modificados desde la última llamada y se
+    combinan con lo que ya estaba en la caché. Si el backend mantiene
+    snapshots, basta con leer el del juego.
+    """
+    if store.snapshots:
+        # Todo lo que dibuja la pantalla está en un solo documento
+        state = state_from_snapshot(store.get_snapshot(game_id))
+        if state:
+            return state
+
+    game = store.get_game(game_id)
+
+    if not game:
+        return None
+
+    if cache is None:
+        # Obtener jugadores
+        players = store.list_players(game_id)
+
+        # Obtener mensajes del chat (solo los de la ronda actual)
+        messages = visible_messages(store.list_messages(game_id, game['current_round']))
+
+        return {
+            'game': game,
+            'players': players,
+            'messages': messages
+        }
+
+    # Reiniciar la caché si la sesión cambió de juego
+    if cache.get('game_id') != game_id:
+        cache.clear()
+        cache.update({
+            'game_id': game_id,
+            'players': {},
+            'messages': [],
+            'players_cursor': None,
+            'messages_round': None,
+            'messages_cursor': None
+        })
+
+    # Ronda nueva: los mensajes de la anterior ya no se muestran
+    if cache['messages_round'] != game['current_round']:
+        cache.update({
+            'messages_round': game['current_round'],
+            'messages': [],
+            'messages_cursor': None
+        })
+
+    # Jugadores nuevos o modificados
+    if cache['players_cursor'] is None:
+        changed_players = store.list_players(game_id)
+    else:
+        changed_players = store.list_players_since(game_id, cache['players_cursor'] - SYNC_OVERLAP)
+    cache['players'].update(changed_players)
+    for player in changed_players.values():
+        if player.get('updated_at') and (cache['players_cursor'] is None or player['updated_at'] > cache['players_cursor']):
+            cache['players_cursor'] = player['updated_at']
+
+    # Mensajes nuevos (y los ya conocidos que se releen, p. ej. los que se están generando)
+    if cache['messages_cursor'] is None:
+        fetched = store.list_messages(game_id, game['current_round'])
+    else:
+        fetched = store.list_messages_since(game_id, game['current_round'], cache['messages_cursor'] - SYNC_OVERLAP)
+    if fetched:
+        positions = {msg['id']: i for i, msg in enumerate(cache['messages'])}
+        for msg in fetched:
+            if msg['id'] in positions:
+                cache['messages'][positions[msg['id']]] = msg
+            else:
+                cache['messages'].append(msg)
+        cache['messages'].sort(key=lambda msg: msg['timestamp'])
+        # No avanzar más allá de un mensaje que aún se está generando: sus
+        # actualizaciones no cambian su marca de tiempo
+        streaming = [msg['timestamp'] for msg in cache['messages'] if msg.get('streaming')]
+        cache['messages_cursor'] = min(streaming) if streaming else cache['messages'][-1]['timestamp']
+
+    return {
+        'game': game,
+        'players': dict(cache['players']),
+        'messages': visible_messages(cache['messages'])
+    }
+
+def state_from_snapshot(snapshot):
+    """Estado del juego a partir de su snapshot (None si no existe o está incompleto)"""
+    # Sin `seeded` el juego se creó antes de activar los snapshots y faltan campos
+    if not snapshot or not snapshot.get('seeded') or not snapshot.get('game'):
+        return None
+    game = snapshot['game']
+    # Los mensajes de una ronda anterior que lleguen tarde no se muestran
+    messages = [msg for msg in snapshot.get('messages', {}).values()
+                if msg.get('round') == game.get('current_round') and 'timestamp' in msg]
+    return {
+        'game': game,
+        'players': snapshot.get('players', {}),
+        'messages': visible_messages(messages)
+    }
+
+def game_config(game_id):
+    """Configuración fija de un juego ya iniciado, leída una vez por proceso"""
+    config = _game_configs.get(game_id)
+    if config is None:
+        game_data = store.get_game(game_id)
+        if not game_data:
+            return None
+        config = {'messages_per_player': game_data['messages_per_player']}
+        # Mientras el juego está en espera el anfitrión aún puede cambiarla
+        if game_data['status'] != 'waiting':
+            if len(_game_configs) >= GAME_CONFIG_CACHE_SIZE:
+                _game_configs.clear()
+            _game_configs[game_id] = config
+    return config
+
+@metrics.timed
+def send_message(game_id, player_id, message_text, deliver_at=None):
+    """Enviar un mensaje al chat (con `deliver_at`, visible a partir de esa hora)
+
+    La comprobación del límite, el mensaje y el contador del jugador se
+    confirman en una sola transacción. La ronda es la del jugador, que
+    `end_round` avanza junto con sus contadores (la del juego si el jugador
+    no la tiene).
+    """
+    config = game_config(game_id)
+    if not config:
+        return False, "Juego no encontrado"
+
+    message_id = str(uuid.uuid4())
+
+    def send(transaction):
+        player_data = transaction.get_player(game_id, player_id)
+        if not player_data:
+            return None, "Jugador no encontrado"
+
+        if player_data['messages_sent'] >= config['messages_per_player']:
+            return None, "Has alcanzado el límite de mensajes para esta ronda"
+
+        current_round = player_data.get('round')
+        if current_round is None:
+            # Jugadores de juegos anteriores a este campo: la ronda del juego
+            current_round = transaction.get_game(game_id)['current_round']
+
+        # Crear mensaje
+        message_data = {
+            'player_id': player_id,
+            'player_name': player_data['name'],
+            'content': message_text,
+            'timestamp': SERVER_TIMESTAMP,
+            'round': current_round
+        }
+        if deliver_at:
+            message_data['deliver_at'] = deliver_at
+
+        # Guardar mensaje y actualizar contador de mensajes del jugador
+        transaction.add_message(game_id, message_id, message_data)
+        transaction.update_player(game_id, player_id, {
+            'messages_sent': Increment(1)
+        })
+        return player_data, message_data['round']
+
+    player_data, current_round = store.run_transaction(send)
+    if player_data is None:
+        return False, current_round
+
+    # Si es un agente IA, generar y enviar respuesta automática
+    if player_data.get('is_ai', False):
+        # Historial de la ronda actual
+        chat_history = visible_messages(store.list_messages(game_id, current_round))
+
+        # Últimos mensajes completos y resumen de los anteriores
+        summary, chat_history = build_context(store, game_id, current_round, chat_history)
+        ai_response = get_ai_response(player_data['ai_type'], message_text, chat_history, player_data, summary=summary)
+
+        # Crear mensaje de respuesta de la IA
+        ai_message_id = str(uuid.uuid4())
+        ai_message_data = {
+            'player_id': player_id,
+            'player_name': player_data['name'],
+            'content': ai_response,
+            'timestamp': SERVER_TIMESTAMP,
+            'round': current_round,
+            'is_ai_response': True,
+            'deliver_at': typing_delay(1.5, 4.0, after=deliver_at)
+        }
+
+        # Guardar respuesta de la IA e incrementar el contador del agente en un solo lote
+        with store.batch() as batch:
+            batch.add_message(game_id, ai_message_id, ai_message_data)
+            batch.update_player(game_id, player_id, {
+                'messages_sent': Increment(1)
+            })
+
+    # Importante: Hacer que los agentes IA reaccionen a los mensajes de humanos
+    if not player_data.get('is_ai', False):
+        # Si es un mensaje de un humano, hacer que algunos agentes IA respondan en segundo plano
+        ai_jobs.submit(trigger_ai_responses, game_id, player_id, message_text, current_round)
+
+    return True, "Mensaje enviado correctamente"
+
+
+@metrics.timed
+def submit_vote(game_id, voter_id, votes):
+    """Enviar votos sobre quién es IA"""
+    def record_vote(transaction):
+        game_data = transaction.get_game(game_id)
+        voters = dict(game_data.get('voters') or {})
+
+        # Actualizar votos del jugador
+        transaction.update_player(game_id, voter_id, {
+            'votes': votes
+        })
+        if votes and voter_id not in voters:
+            voters[voter_id] = True
+            transaction.update_game(game_id, {f'voters.{voter_id}': True})
+
+        # Todos los humanos han votado: solo quien cierra la ronda la finaliza
+        current_round = game_data['current_round']
+        if (len(voters) >= game_data.get('human_count', game_data['settings']['human_players'])
+                and game_data.get('closed_round') != current_round):
+            transaction.update_game(game_id, {'closed_round': current_round})
+            return True
+        return False
+
+    if store.run_transaction(record_vote):
+        end_round(game_id)
+
+    return True, "Votos registrados correctamente"
+
+@metrics.timed
+def end_round(game_id):
+    """Finalizar la ronda actual y calcular resultados"""
+    game_data = store.get_game(game_id)
+
+    # Obtener todos los jugadores y sus votos
+    players = store.list_players(game_id)
+
+    # Calcular resultados
+    results = {
+        'round': game_data['current_round'],
+        'ai_correct_identifications': 0,
+        'human_correct_identifications': 0,
+        'player_results': {}
+    }
+
+    # Aciertos de cada votante, calculados en memoria
+    scores = {}
+
+    for voter_id, voter in players.items():
+        if voter.get('is_ai', False):
+            continue  # Solo contar votos de humanos
+
+        votes = voter.get('votes', {})
+        for voted_id, is_ai_vote in votes.items():
+            voted_player = players.get(voted_id, {})
+
+            # Si el voto coincide con la realidad
+            if is_ai_vote == voted_player.get('is_ai', False):
+                if voted_player.get('is_ai', False):
+                    results['human_correct_identifications'] += 1
+                else:
+                    results['ai_correct_identifications'] += 1
+
+                # Incrementar puntaje del votante
+                scores[voter_id] = scores.get(voter_id, 0) + 1
+
+            # Registrar resultado individual
+            if voted_id not in results['player_results']:
+                results['player_results'][voted_id] = {
+                    'correct_votes': 0,
+                    'total_votes': 0
+                }
+
+            results['player_results'][voted_id]['total_votes'] += 1
+            if is_ai_vote == voted_player.get('is_ai', False):
+                results['player_results'][voted_id]['correct_votes'] += 1
+
+    last_round = game_data['current_round'] >= game_data['max_rounds']
+
+    # Totales acumulados de la partida, incluida esta ronda
+    previous = game_data.get('totals')
+    if previous is None:
+        # Juegos sin totales acumulados: partir de las rondas ya puntuadas
+        previous = sum_round_results(game_id, before_round=game_data['current_round'])
+    totals = {
+        'ai_correct': previous['ai_correct'] + results['ai_correct_identifications'],
+        'human_correct': previous['human_correct'] + results['human_correct_identifications']
+    }
+
+    # Resultados, puntajes y preparación de la siguiente ronda en un solo lote
+    with store.batch() as batch:
+        # Guardar resultados de la ronda
+        batch.set_round_result(game_id, game_data['current_round'], results)
+
+        for player_id in players:
+            fields = {}
+            if scores.get(player_id):
+                fields['score'] = Increment(scores[player_id])
+            if not last_round:
+                # Reiniciar contadores de mensajes y votos para la siguiente ronda
+                fields.update({
+                    'round': game_data['current_round'] + 1,
+                    'messages_sent': 0,
+                    'votes': {}
+                })
+            if fields:
+                batch.update_player(game_id, player_id, fields)
+
+        if game_data.get('totals') is not None:
+            batch.update_game(game_id, {
+                'totals.ai_correct': Increment(results['ai_correct_identifications']),
+                'totals.human_correct': Increment(results['human_correct_identifications'])
+            })
+        else:
+            # Primera ronda con totales: se guardan completos
+            batch.update_game(game_id, {'totals': totals})
+
+        if last_round:
+            # El juego termina en el mismo lote
+            end_game(game_id, batch=batch, totals=totals, players=players)
+        else:
+            # Preparar siguiente ronda
+            batch.update_game(game_id, {
+                'current_round': game_data['current_round'] + 1,
+                'round_started_at': SERVER_TIMESTAMP,
+                'voters': {}
+            })
+
+def sum_round_results(game_id, before_round=None):
+    """Aciertos de IA y humanos sumando los resultados guardados de cada ronda
+
+    Con `before_round` solo cuentan las rondas anteriores a esa.
+    """
+    totals = {'ai_correct': 0, 'human_correct': 0}
+    for round_data in store.list_round_results(game_id):
+        if before_round is not None and round_data.get('round', 0) >= before_round:
+            continue
+        totals['ai_correct'] += round_data.get('ai_correct_identifications', 0)
+        totals['human_correct'] += round_data.get('human_correct_identifications', 0)
+    return totals
+
+@metrics.timed
+def end_game(game_id, batch=None, totals=None, players=None):
+    """Finalizar el juego y calcular resultados finales
+
+    `end_round` pasa su lote abierto, los totales ya calculados y los
+    jugadores para que todo se confirme en una sola escritura.
+    """
+    if totals is None:
+        totals = store.get_game(game_id).get('totals')
+    if totals is None:
+        # Juegos sin totales acumulados: sumar los resultados de todas las rondas
+        totals = sum_round_results(game_id)
+
+    ai_total = totals['ai_correct']
+    human_total = totals['human_correct']
+
+    # Determinar ganador
+    if ai_total > human_total:
+        winner = "IA"
+    elif human_total > ai_total:
+        winner = "Humanos"
+    else:
+        winner = "Empate"
+
+    if players is None:
+        players = store.list_players(game_id)
+
+    own_batch = batch is None
+    if own_batch:
+        batch = store.batch()
+
+    # Guardar resultados finales
+    batch.update_game(game_id, {
+        'status': 'finished',
+        'ended_at': SERVER_TIMESTAMP,
+        'final_results': {
+            'ai_score': ai_total,
+            'human_score': human_total,
+            'winner': winner
+        }
+    })
+
+    # Revelar identidades de los jugadores
+    for player_id, player_data in players.items():
+        if player_data.get('is_ai', False):
+            batch.update_player(game_id, player_id, {
+                'revealed': True
+            })
+
+    if own_batch:
+        batch.commit()
+
+@metrics.timed
+def trigger_ai_responses(game_id, human_player_id, human_message, current_round):
+    """Hacer que los agentes IA respondan a mensajes de humanos"""
+    players = store.list_players(game_id)
+    config = game_config(game_id)
+    if not config:
+        return
+
+    # Obtener todos los agentes IA disponibles (que aún tengan mensajes disponibles);
+    # el cupo se reserva de verdad en respond_to_human
+    ai_agents = [(p_id, p) for p_id, p in players.items()
+                 if p.get('is_ai', False) and p.get('messages_sent', 0) < config['messages_per_player']]
+
+    # Si no hay agentes disponibles, no hacer nada
+    if not ai_agents:
+        return
+
+    # Determinar cuántos agentes responderán (entre 1 y 2)
+    num_responders = min(random.randint(1, 2), len(ai_agents))
+
+    # Seleccionar agentes aleatorios para responder
+    responders = random.sample(ai_agents, num_responders)
+
+    # Obtener historial de mensajes para contexto
+    chat_history = visible_messages(store.list_messages(game_id, current_round))
+
+    # Últimos mensajes completos y resumen de los anteriores
+    summary, chat_history = build_context(store, game_id, current_round, chat_history)
+
+    # Cada agente seleccionado responde en su propio trabajo, en paralelo
+    human_name = players[human_player_id]['name']
+    for agent_id, agent_data in responders:
+        ai_jobs.submit(respond_to_human, game_id, agent_id, agent_data, human_player_id,
+                       human_name, human_message, chat_history, current_round, summary)
+
+def reserve_ai_message(game_id, agent_id):
+    """Reservar un mensaje del cupo de un agente antes de generarlo
+
+    Las respuestas se generan en paralelo, así que la comprobación del límite
+    y el contador se confirman juntos en una transacción. Devuelve los datos
+    del agente, o None si ya no le quedan mensajes.
+    """
+    config = game_config(game_id)
+    if not config:
+        return None
+
+    def reserve(transaction):
+        agent_data = transaction.get_player(game_id, agent_id)
+        if not agent_data or agent_data.get('messages_sent', 0) >= config['messages_per_player']:
+            return None
+        transaction.update_player(game_id, agent_id, {
+            'messages_sent': Increment(1)
+        })
+        return agent_data
+
+    return store.run_transaction(reserve)
+
+@metrics.timed
+def respond_to_human(game_id, agent_id, agent_data, human_player_id, human_name, human_message, chat_history, current_round, summary=""):
+    """Generar y guardar la respuesta de un agente IA a un mensaje humano"""
+    # Verificar si el agente aún tiene mensajes disponibles (y ocupar uno)
+    agent_data = reserve_ai_message(game_id, agent_id)
+    if agent_data is None:
+        return
+
+    # Generar respuesta del agente, mencionando específicamente al humano
+    context = f"Un humano llamado {human_name} acaba de escribir: '{human_message}'. Respóndele directamente."
+
+    if AI_STREAMING:
+        stream_ai_reply(game_id, agent_id, agent_data, context, chat_history, current_round,
+                        summary=summary, in_response_to=human_player_id)
+        return
+
+    # Retraso aleatorio para simular tiempo de escritura humana (incluye lo que tarde el modelo)
+    deliver_at = typing_delay(1.5, 4.0)
+
+    ai_response = get_ai_response(agent_data['ai_type'], context, chat_history, agent_data, summary=summary)
+
+    # Crear y guardar el mensaje
+    ai_message_id = str(uuid.uuid4())
+    ai_message_data = {
+        'player_id': agent_id,
+        'player_name': agent_data['name'],
+        'content': ai_response,
+        'timestamp': SERVER_TIMESTAMP,
+        'round': current_round,
+        'is_ai_response': True,
+        'in_response_to': human_player_id,  # Para indicar que es una respuesta directa
+        'deliver_at': deliver_at
+    }
+
+    # Guardar respuesta de la IA (el contador ya se incrementó al reservar)
+    store.add_message(game_id, ai_message_id, ai_message_data)
+
+@metrics.timed
+def stream_ai_reply(game_id, agent_id, agent_data, prompt, chat_history, current_round, summary="", **extra):
+    """Escribir la respuesta de un agente en el chat a medida que se genera
+
+    El mensaje se crea con el primer fragmento (`streaming: True`) y se
+    actualiza como mucho cada STREAM_FLUSH_INTERVAL segundos. La última
+    escritura guarda el texto completo con `streaming: False`. El cupo del
+    agente ya debe estar reservado (ver reserve_ai_message).
+    """
+    message_id = str(uuid.uuid4())
+    state = {'created': False, 'done': False, 'flushed_at': 0.0}
+    lock = threading.Lock()
+
+    def create(text, streaming):
+        store.add_message(game_id, message_id, {
+            'player_id': agent_id,
+            'player_name': agent_data['name'],
+            'content': text,
+            'timestamp': SERVER_TIMESTAMP,
+            'round': current_round,
+            'is_ai_response': True,
+            'streaming': streaming,
+            **extra
+        })
+        state['created'] = True
+
+    def on_text(text):
+        with lock:
+            # Tras el final (p. ej. plazo agotado) se ignoran los fragmentos tardíos
+            if state['done']:
+                return
+            now = time.monotonic()
+            if not state['created']:
+                create(text, True)
+            elif now - state['flushed_at'] >= STREAM_FLUSH_INTERVAL:
+                store.update_message(game_id, current_round, message_id, {'content': text})
+            else:
+                return
+            state['flushed_at'] = now
+
+    ai_response = stream_ai_response(agent_data['ai_type'], prompt, chat_history, on_text, agent_data,
+                                     summary=summary)
+
+    with lock:
+        state['done'] = True
+        if state['created']:
+            store.update_message(game_id, current_round, message_id, {'content': ai_response, 'streaming': False})
+        else:
+            # Sin fragmentos (respuesta de respaldo): guardar el mensaje completo
+            create(ai_response, False)
+    return message_id
+
+# Función para simular mensajes de agentes IA
+@metrics.timed
+def simulate_ai_messages(game_id):
+    """Simular mensajes iniciales de agentes IA"""
+    game_data = store.get_game(game_id)
+
+    if game_data['status'] != 'playing':
+        return False
+
+    # Obtener agentes IA
+    ai_agents = [(p_id, p) for p_id, p in store.list_players(game_id).items()
+                 if p.get('is_ai', False)]
+
+    # Mensajes iniciales más variados y personalizados
+    initial_messages = [
+        "Hola a todos! Primera vez en uno de estos juegos, ¿cómo funciona exactamente?",
+        "¡Qué tal! Me acabo de unir porque un amigo me lo recomendó. ¿Alguien más es nuevo?",
+        "Saludos desde Madrid, espero que todos estén bien hoy. ¿De dónde son ustedes?",
+        "¡Hola grupo! Estaba tomando café cuando me acordé que teníamos esta actividad, casi lo olvido jaja",
+        "Buenas! Acabo de terminar un día intenso de trabajo y me hacía ilusión participar en esto.",
+        "Hola a todos :) Me llamo {}, soy nueva/o aquí. ¿Qué tal están?",
+        "¡Hola! Primera vez participando en esto, me parece un concepto fascinante. ¿Alguien me explica más?",
+        "Hey! Me han dicho que esto es como un juego de detectives para identificar IAs. Qué interesante!",
+        "Hola a todos, acabo de conectarme. Se me hizo un poco tarde por el tráfico, lo siento!",
+        "¡Hola grupo! Este juego me recuerda a las partidas de 'Among Us' que hacíamos en pandemia, ¿a alguien más?"
+    ]
+
+    # Preparar el mensaje inicial de cada agente IA, con entregas escalonadas
+    openers = []
+    deliver_at = None
+    for agent_id, agent_data in ai_agents:
+        # Verificar si el agente ya ha enviado algún mensaje
+        if agent_data.get('messages_sent', 0) > 0:
+            continue
+
+        # Seleccionar un mensaje aleatorio y personalizarlo
+        message_template = random.choice(initial_messages)
+        if "{}" in message_template:
+            message = message_template.format(agent_data['name'])
+        else:
+            message = message_template
+
+        # Añadir un pequeño retraso aleatorio para simular tiempos de escritura humana
+        deliver_at = typing_delay(1.0, 3.0, after=deliver_at)
+
+        openers.append((agent_id, agent_data, {
+            'player_id': agent_id,
+            'player_name': agent_data['name'],
+            'content': message,
+            'timestamp': SERVER_TIMESTAMP,
+            'round': game_data['current_round'],
+            'deliver_at': deliver_at
+        }))
+
+    # Generar en paralelo la respuesta de cada agente a su propio mensaje;
+    # cada uno ve los mensajes iniciales que se entregan antes que el suyo
+    replies = [
+        ai_jobs.submit(get_ai_response, agent_data['ai_type'], opener['content'],
+                       [o[2] for o in openers[:i + 1]], agent_data)
+        for i, (agent_id, agent_data, opener) in enumerate(openers)
+    ]
+
+    # Guardar todos los mensajes y contadores en un solo lote
+    with store.batch() as batch:
+        for (agent_id, agent_data, opener), reply in zip(openers, replies):
+            try:
+                ai_response = reply.result()
+            except Exception:
+                ai_response = get_fallback_response(opener['content'], "")
+
+            batch.add_message(game_id, str(uuid.uuid4()), opener)
+            batch.add_message(game_id, str(uuid.uuid4()), {
+                'player_id': agent_id,
+                'player_name': agent_data['name'],
+                'content': ai_response,
+                'timestamp': SERVER_TIMESTAMP,
+                'round': game_data['current_round'],
+                'is_ai_response': True,
+                'deliver_at': typing_delay(1.5, 4.0, after=opener['deliver_at'])
+            })
+            batch.update_player(game_id, agent_id, {
+                'messages_sent': Increment(2)
+            })
+
+    return True
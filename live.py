@@ -0,0 +1,128 @@
+"""Actualizaciones en vivo: una suscripción por juego y proceso, compartida por todas las sesiones"""
+import threading
+import time
+
+
+class GameHub:
+    """Caché del estado de cada juego alimentada por los listeners del almacenamiento.
+
+    Cada juego tiene un número de versión que aumenta con cada cambio, así las
+    sesiones solo vuelven a dibujar la pantalla cuando su juego cambió.
+    """
+
+    def __init__(self, store, idle_timeout=600):
+        self.store = store
+        self.idle_timeout = idle_timeout
+        self._games = {}
+        self._cond = threading.Condition()
+
+    def _on_change(self, game_id, kind, data):
+        with self._cond:
+            entry = self._games.get(game_id)
+            if entry is None:
+                return
+            entry['state'][kind] = data
+            entry['loaded'].add(kind)
+            entry['version'] += 1
+            self._cond.notify_all()
+
+    def _subscribe(self, game_id):
+        with self._cond:
+            entry = self._games.get(game_id)
+            if entry is not None:
+                entry['last_access'] = time.time()
+                return entry
+            entry = {
+                'state': {'game': None, 'players': {}, 'messages': []},
+                'loaded': set(),
+                'version': 0,
+                'last_access': time.time(),
+                'unsubscribe': None
+            }
+            self._games[game_id] = entry
+
+        # Fuera del candado: los backends locales envían el estado inicial de inmediato
+        entry['unsubscribe'] = self.store.watch_game(
+            game_id, lambda kind, data: self._on_change(game_id, kind, data))
+        self._release_idle()
+        return entry
+
+    def _release_idle(self):
+        """Cancelar las suscripciones de juegos que nadie ha mirado en un rato"""
+        now = time.time()
+        with self._cond:
+            idle = [game_id for game_id, entry in self._games.items()
+                    if now - entry['last_access'] > self.idle_timeout and entry['unsubscribe']]
+            entries = [self._games.pop(game_id) for game_id in idle]
+        for entry in entries:
+            entry['unsubscribe']()
+
+    def get_state(self, game_id, timeout=10):
+        """Devolver (estado, versión) del juego sin leer del almacenamiento"""
+        entry = self._subscribe(game_id)
+        with self._cond:
+            self._cond.wait_for(lambda: len(entry['loaded']) == 3, timeout)
+            state = entry['state']
+            if not state['game']:
+                return None, entry['version']
+            return {
+                'game': state['game'],
+                'players': dict(state['players']),
+                'messages': list(state['messages'])
+            }, entry['version']
+
+    def wait_for_change(self, game_id, version, timeout):
+        """Esperar hasta que la versión del juego cambie; devuelve True si cambió"""
+        entry = self._subscribe(game_id)
+        with self._cond:
+            return self._cond.wait_for(lambda: entry['version'] != version, timeout)
+
+
+class StateCache:
+    """Estado de cada juego compartido por todas las sesiones del proceso.
+
+    Una entrada sirve durante `ttl` segundos o hasta que este proceso escriba
+    en el juego (ver `invalidate`). Solo una sesión a la vez recarga cada juego;
+    las demás esperan y reutilizan el resultado.
+    """
+
+    def __init__(self, ttl=1.0, idle_timeout=600):
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, game_id):
+        """Marcar el estado del juego como obsoleto (se llama tras cada escritura local)"""
+        with self._lock:
+            self._versions[game_id] = self._versions.get(game_id, 0) + 1
+
+    def _entry(self, game_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is None:
+                # Olvidar los juegos que nadie ha mirado en un rato
+                for idle_id in [g for g, e in self._entries.items() if now - e['last_access'] > self.idle_timeout]:
+                    del self._entries[idle_id]
+                    self._versions.pop(idle_id, None)
+                entry = {'lock': threading.Lock(), 'sync': {}, 'state': None, 'version': None, 'expires': 0}
+                self._entries[game_id] = entry
+            entry['last_access'] = now
+            return entry
+
+    def get(self, game_id, loader):
+        """Estado del juego; `loader(sync)` lo lee del almacenamiento si hace falta
+
+        `sync` es un diccionario propio del juego para la sincronización incremental.
+        """
+        entry = self._entry(game_id)
+        with entry['lock']:
+            with self._lock:
+                version = self._versions.get(game_id, 0)
+            if entry['version'] == version and time.monotonic() < entry['expires']:
+                return entry['state']
+            state = loader(entry['sync'])
+            entry.update(state=state, version=version, expires=time.monotonic() + self.ttl)
+            return state
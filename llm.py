@@ -0,0 +1,492 @@
+"""Clientes de los proveedores de IA (Claude y Gemini), creados una sola vez por proceso"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import anthropic
+import httpx
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from dotenv import load_dotenv
+
+import metrics
+from context import estimate_tokens
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de las APIs
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+CLAUDE_MODEL = "claude-3-sonnet-20240229"
+GEMINI_MODEL = "gemini-1.5-pro"
+
+# Tiempos de espera (segundos) y llamadas simultáneas permitidas por proveedor
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+CLAUDE_CONCURRENCY = int(os.getenv("CLAUDE_CONCURRENCY", "8"))
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+
+# Tiempo máximo (segundos) para tener la respuesta de un agente; 0 = sin límite
+AI_REPLY_DEADLINE = float(os.getenv("AI_REPLY_DEADLINE", "6"))
+
+# Circuito: fallos seguidos para abrirlo y segundos antes de volver a probar
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+
+# Peticiones de cobertura: si el primer proveedor pasa su p95, se pregunta también al otro
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = 20
+
+# Caché de prompts de Anthropic: las instrucciones de sistema de cada agente se
+# procesan una vez y las siguientes respuestas las leen de la caché. Desactivada
+# por defecto: CLAUDE_MODEL no admite caché y las instrucciones actuales (unos 300
+# tokens) no llegan al mínimo cacheable (1024), así que solo añadiría la cabecera beta
+CLAUDE_PROMPT_CACHE = os.getenv("CLAUDE_PROMPT_CACHE", "0") == "1"
+PROMPT_CACHE_BETA = "prompt-caching-2024-07-31"
+
+
+class Reply(str):
+    """Texto de una respuesta con los tokens generados y enviados (None si el proveedor no los informa)"""
+    output_tokens = None
+    input_tokens = None
+
+    @classmethod
+    def of(cls, text, output_tokens, input_tokens=None):
+        reply = cls(text)
+        reply.output_tokens = output_tokens
+        reply.input_tokens = input_tokens
+        return reply
+
+
+class ClaudeProvider:
+    """Cliente de Anthropic con conexiones HTTP persistentes"""
+    name = "claude"
+
+    def __init__(self, api_key, timeout=LLM_TIMEOUT, max_concurrency=CLAUDE_CONCURRENCY):
+        http_client = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=max_concurrency,
+                                max_keepalive_connections=max_concurrency,
+                                keepalive_expiry=120)
+        )
+        self.client = anthropic.Anthropic(api_key=api_key, http_client=http_client, max_retries=1)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _options(self, system, stop):
+        """Instrucciones de sistema (como prefijo cacheable si procede) y secuencias de parada"""
+        options = {'system': system}
+        if CLAUDE_PROMPT_CACHE:
+            options = {
+                'system': [{'type': 'text', 'text': system, 'cache_control': {'type': 'ephemeral'}}],
+                'extra_headers': {'anthropic-beta': PROMPT_CACHE_BETA}
+            }
+        if stop:
+            options['stop_sequences'] = list(stop)
+        return options
+
+    def generate(self, system, messages, max_tokens, temperature, stop=None):
+        """`messages` en formato de Anthropic: [{'role': ..., 'content': ...}]"""
+        with self._slots:
+            response = self.client.messages.create(
+                model=CLAUDE_MODEL,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=messages,
+                **self._options(system, stop)
+            )
+        usage = response.usage
+        metrics.record_tokens(self.name, usage.input_tokens, usage.output_tokens)
+        return Reply.of(response.content[0].text, usage.output_tokens, usage.input_tokens)
+
+    def stream(self, system, messages, max_tokens, temperature, stop=None):
+        """Igual que `generate`, pero devuelve los fragmentos de texto según llegan"""
+        with self._slots:
+            with self.client.messages.stream(
+                model=CLAUDE_MODEL,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=messages,
+                **self._options(system, stop)
+            ) as stream:
+                for text in stream.text_stream:
+                    yield text
+                usage = stream.get_final_message().usage
+        metrics.record_tokens(self.name, usage.input_tokens, usage.output_tokens)
+
+
+class _TimeoutClient:
+    """Aplica un tiempo de espera a cada llamada del cliente gRPC compartido de Gemini.
+
+    Se desactivan los reintentos automáticos: con ellos una llamada fallida
+    puede tardar hasta 60 segundos sin importar el tiempo de espera.
+    """
+
+    def __init__(self, client, timeout):
+        self._client = client
+        self._timeout = timeout
+
+    def generate_content(self, request):
+        return self._client.generate_content(request, timeout=self._timeout, retry=None)
+
+    def stream_generate_content(self, request):
+        return self._client.stream_generate_content(request, timeout=self._timeout, retry=None)
+
+
+class GeminiProvider:
+    """Modelos de Gemini reutilizados sobre un único canal gRPC"""
+    name = "gemini"
+
+    def __init__(self, api_key, timeout=LLM_TIMEOUT, max_concurrency=GEMINI_CONCURRENCY):
+        genai.configure(api_key=api_key)
+        self._client = _TimeoutClient(genai_client.get_default_generative_client(), timeout)
+        self._models = {}
+        self._models_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _model(self, max_tokens, temperature, stop=None):
+        key = (max_tokens, temperature, tuple(stop or ()))
+        with self._models_lock:
+            if key not in self._models:
+                generation_config = {
+                    "temperature": temperature,
+                    "max_output_tokens": max_tokens,
+                }
+                if stop:
+                    generation_config["stop_sequences"] = list(stop)
+                model = genai.GenerativeModel(
+                    model_name=GEMINI_MODEL,
+                    generation_config=generation_config,
+                )
+                # La versión 0.3 de google-generativeai no acepta un timeout por
+                # llamada, así que se sustituye el cliente del modelo
+                model._client = self._client
+                self._models[key] = model
+            return self._models[key]
+
+    def generate(self, system, prompt, max_tokens, temperature, stop=None):
+        """`prompt` es el texto de la conversación ya formateado"""
+        model = self._model(max_tokens, temperature, stop)
+        with self._slots:
+            response = model.generate_content([system, prompt])
+        token_count = response.candidates[0].token_count if response.candidates else 0
+        # Esta versión de la API no informa de los tokens de entrada: se estiman
+        input_tokens = estimate_tokens(system) + estimate_tokens(prompt)
+        metrics.record_tokens(self.name, input_tokens, token_count or estimate_tokens(response.text))
+        return Reply.of(response.text, token_count or None, input_tokens)
+
+    def stream(self, system, prompt, max_tokens, temperature, stop=None):
+        """Igual que `generate`, pero devuelve los fragmentos de texto según llegan"""
+        model = self._model(max_tokens, temperature, stop)
+        text = ""
+        with self._slots:
+            for chunk in model.generate_content([system, prompt], stream=True):
+                text += chunk.text
+                yield chunk.text
+        metrics.record_tokens(self.name, estimate_tokens(system) + estimate_tokens(prompt), estimate_tokens(text))
+
+
+class DeadlineExceeded(TimeoutError):
+    """Ningún proveedor respondió dentro del tiempo asignado"""
+
+
+class ProviderStats:
+    """Latencias y resultados recientes de un proveedor"""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._output_tokens = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok, output_tokens=None):
+        with self._lock:
+            if ok:
+                self._latencies.append(latency)
+                if output_tokens is not None:
+                    self._output_tokens.append(output_tokens)
+            self._outcomes.append(ok)
+
+    def percentile(self, p):
+        """Percentil `p` de la latencia en segundos, o None si no hay datos"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    def samples(self):
+        with self._lock:
+            return len(self._latencies)
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return self._outcomes.count(False) / len(self._outcomes)
+
+    def mean_output_tokens(self):
+        """Tokens generados por respuesta (media reciente), o None si no hay datos"""
+        with self._lock:
+            if not self._output_tokens:
+                return None
+            return sum(self._output_tokens) / len(self._output_tokens)
+
+
+class CircuitBreaker:
+    """Deja de llamar a un proveedor tras varios fallos seguidos y lo vuelve a probar más tarde"""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURES, cooldown=CIRCUIT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"  # closed, open, half_open
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                # Dejar pasar una sola llamada de prueba
+                self.state = "half_open"
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.state = "closed"
+                self._failures = 0
+                return
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class ProviderRouter:
+    """Elige proveedor según el tipo de agente, su circuito y su latencia reciente"""
+
+    def __init__(self, names, hedge=LLM_HEDGE):
+        self.hedge = hedge
+        self.stats = {name: ProviderStats() for name in names}
+        self.breakers = {name: CircuitBreaker() for name in names}
+        # Respuestas dentro y fuera del tiempo máximo
+        self.deadline_hits = 0
+        self.deadline_misses = 0
+        self._counts_lock = threading.Lock()
+        # Pool propio: quien llama suele ser ya un hilo de la cola de trabajos de IA
+        self._executor = ThreadPoolExecutor(CLAUDE_CONCURRENCY + GEMINI_CONCURRENCY, thread_name_prefix="llm-call")
+
+        # El resumen de `report` también se publica como métricas (el último router creado)
+        for name, stats in self.stats.items():
+            metrics.llm_recent_latency.set_function(lambda stats=stats: stats.percentile(50), provider=name, quantile="0.5")
+            metrics.llm_recent_latency.set_function(lambda stats=stats: stats.percentile(95), provider=name, quantile="0.95")
+            metrics.llm_recent_error_rate.set_function(stats.error_rate, provider=name)
+            metrics.llm_recent_output_tokens.set_function(stats.mean_output_tokens, provider=name)
+
+    def _timed(self, name, call):
+        start = time.monotonic()
+        try:
+            result = call()
+        except Exception:
+            self.stats[name].record(time.monotonic() - start, False)
+            self.breakers[name].record(False)
+            metrics.llm_seconds.observe(time.monotonic() - start, provider=name, outcome="error")
+            raise
+        self.stats[name].record(time.monotonic() - start, True, getattr(result, 'output_tokens', None))
+        metrics.llm_seconds.observe(time.monotonic() - start, provider=name, outcome="ok")
+        self.breakers[name].record(True)
+        return result
+
+    def report(self):
+        """Resumen por proveedor: latencia p50/p95 (s), tasa de error y tokens por respuesta"""
+        return {
+            name: {
+                'p50': stats.percentile(50),
+                'p95': stats.percentile(95),
+                'error_rate': stats.error_rate(),
+                'output_tokens': stats.mean_output_tokens()
+            }
+            for name, stats in self.stats.items()
+        }
+
+    def _hedge_after(self, name):
+        if not self.hedge or self.stats[name].samples() < HEDGE_MIN_SAMPLES:
+            return None
+        return self.stats[name].percentile(95)
+
+    def _count_deadline(self, hit):
+        with self._counts_lock:
+            if hit:
+                self.deadline_hits += 1
+            else:
+                self.deadline_misses += 1
+        metrics.ai_deadline.inc(result="hit" if hit else "miss")
+
+    def generate(self, preferred, calls, deadline=None):
+        """Ejecutar la llamada del proveedor preferido, con los demás como respaldo.
+
+        `calls` es {nombre: función sin argumentos}. Devuelve el primer
+        resultado correcto; si todos fallan, relanza el último error. Con
+        `deadline` (segundos) lanza DeadlineExceeded al agotarse el tiempo,
+        sin esperar a las llamadas que sigan en curso.
+        """
+        expires_at = time.monotonic() + deadline if deadline else None
+        order = [preferred] + [name for name in calls if name != preferred]
+        candidates = [name for name in order if name in calls]
+
+        pending = {}
+        last_error = None
+
+        def launch():
+            # El circuito se consulta justo antes de llamar: si deja pasar la
+            # llamada de prueba, esa llamada se hace y su resultado lo cierra o reabre
+            while candidates:
+                name = candidates.pop(0)
+                if self.breakers[name].allow():
+                    pending[self._executor.submit(self._timed, name, calls[name])] = name
+                    return name
+            return None
+
+        current = launch()
+        if current is None:
+            raise RuntimeError("No hay proveedores de IA disponibles (circuitos abiertos)")
+        while pending:
+            hedge_after = self._hedge_after(current) if candidates and len(pending) == 1 else None
+            timeout = hedge_after
+            if expires_at is not None:
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    self._count_deadline(False)
+                    raise DeadlineExceeded(f"Sin respuesta en {deadline} s")
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_after is not None and timeout == hedge_after:
+                    # El proveedor pasó su p95: lanzar una petición de cobertura al siguiente
+                    current = launch() or current
+                continue
+            for future in done:
+                pending.pop(future)
+                if future.exception() is None:
+                    if expires_at is not None:
+                        self._count_deadline(True)
+                    return future.result()
+                last_error = future.exception()
+            if not pending and candidates:
+                current = launch()
+        raise last_error
+
+    def generate_stream(self, preferred, calls, on_text, deadline=None):
+        """Como `generate`, pero cada llamada devuelve fragmentos de texto.
+
+        `on_text(texto_acumulado)` se llama con cada fragmento. Si se agota
+        `deadline` o el proveedor falla a mitad, se devuelve lo recibido hasta
+        ese momento; sin texto se prueba el siguiente proveedor o se lanza el
+        error. No se usan peticiones de cobertura.
+        """
+        expires_at = time.monotonic() + deadline if deadline else None
+        order = [preferred] + [name for name in calls if name != preferred]
+        candidates = [name for name in order if name in calls]
+
+        last_error = None
+        expired = False
+        for name in candidates:
+            remaining = None
+            if expires_at is not None:
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    expired = True
+                    break
+            # El circuito se consulta justo antes de llamar (ver `generate`)
+            if not self.breakers[name].allow():
+                continue
+
+            state = {'text': "", 'stop': False}
+
+            def consume(call=calls[name], state=state):
+                for chunk in call():
+                    if state['stop']:
+                        break
+                    state['text'] += chunk
+                    on_text(state['text'])
+                return state['text']
+
+            future = self._executor.submit(self._timed, name, consume)
+            try:
+                text = future.result(timeout=remaining)
+            except FutureTimeout:
+                state['stop'] = True
+                self._count_deadline(False)
+                if state['text']:
+                    # Mejor respuesta parcial disponible
+                    return state['text']
+                raise DeadlineExceeded(f"Sin respuesta en {deadline} s")
+            except Exception as e:
+                last_error = e
+                if state['text']:
+                    return state['text']
+                continue
+            if expires_at is not None:
+                self._count_deadline(True)
+            return text
+
+        if last_error is None:
+            if not expired:
+                raise RuntimeError("No hay proveedores de IA disponibles (circuitos abiertos)")
+            self._count_deadline(False)
+            raise DeadlineExceeded(f"Sin respuesta en {deadline} s")
+        raise last_error
+
+
+class Providers:
+    """Proveedores disponibles y errores de configuración para mostrar en la interfaz"""
+
+    def __init__(self, claude=None, gemini=None, errors=None):
+        self.claude = claude
+        self.gemini = gemini
+        self.errors = errors or []
+        self.router = None
+
+
+_providers = None
+_providers_lock = threading.Lock()
+
+
+def get_providers():
+    """Crear los clientes una sola vez por proceso y compartirlos entre sesiones e hilos.
+
+    Se guarda en el módulo en lugar de usar `st.cache_resource`, que no cachea
+    fuera de una sesión de Streamlit (pruebas de carga, scripts).
+    """
+    global _providers
+    with _providers_lock:
+        if _providers is None:
+            _providers = _create_providers()
+        return _providers
+
+
+def _create_providers():
+    providers = Providers()
+
+    if ANTHROPIC_API_KEY:
+        try:
+            providers.claude = ClaudeProvider(ANTHROPIC_API_KEY)
+        except TypeError:
+            providers.errors.append("Error al inicializar el cliente de Anthropic. Instala: pip install httpx==0.27.2")
+
+    try:
+        if GEMINI_API_KEY:
+            providers.gemini = GeminiProvider(GEMINI_API_KEY)
+    except Exception as e:
+        providers.errors.append(f"Error al configurar Gemini: {str(e)}")
+
+    providers.router = ProviderRouter([p.name for p in (providers.claude, providers.gemini) if p])
+    return providers
@@ -0,0 +1,298 @@
+"""Métricas del proceso en memoria, exportadas en formato de texto de Prometheus
+
+Latencia de las funciones del juego, del backend de almacenamiento y de los
+modelos; documentos leídos y escritos por acción del juego; tokens de los
+modelos; respuestas de respaldo y trabajos de IA pendientes. Se leen con
+`render()`, en http://localhost:METRICS_PORT/metrics o en el fichero
+METRICS_DUMP.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Medir las funciones del juego y las llamadas al backend
+METRICS = os.getenv("METRICS", "1") == "1"
+# Puerto del endpoint /metrics (0 = sin endpoint)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Fichero donde volcar las métricas cada METRICS_DUMP_INTERVAL segundos (vacío = sin volcado)
+METRICS_DUMP = os.getenv("METRICS_DUMP", "")
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "15"))
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Acción del juego en curso en cada hilo (ver `timed`)
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def lines(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labels, key)))} {_format_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Valor que solo crece, por combinación de etiquetas"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(_Metric):
+    """Valor instantáneo; con `set_function` se calcula al leerlo"""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn, **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def values(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            # Sin datos (p. ej. un percentil sin muestras): no se publica
+            if value is not None:
+                values[key] = value
+        return values
+
+
+class Histogram(_Metric):
+    """Distribución de valores (p. ej. latencias) en intervalos fijos"""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['counts'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def values(self):
+        """{etiquetas: {'counts': por intervalo (el último es +Inf), 'sum', 'count'}}"""
+        with self._lock:
+            return {key: {**entry, 'counts': list(entry['counts'])} for key, entry in self._values.items()}
+
+    def quantile(self, entry, q):
+        """Límite superior del intervalo donde cae el cuantil `q` de una entrada de `values()`"""
+        target = q * entry['count']
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), entry['counts']):
+            seen += count
+            if seen >= target and seen > 0:
+                return bound
+        return float('inf')
+
+    def lines(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, entry in sorted(self.values().items()):
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry['counts']):
+                cumulative += count
+                labels = _format_labels(pairs + [('le', _format_number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_number(entry['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {entry['count']}")
+        return lines
+
+
+_registry = []
+
+function_seconds = Histogram("turing_function_seconds",
+                             "Duración de las acciones del juego", ["function"])
+store_seconds = Histogram("turing_store_seconds",
+                          "Duración de las llamadas al backend de almacenamiento", ["method"])
+store_reads = Counter("turing_store_reads_total",
+                      "Documentos leídos, por acción del juego", ["action"])
+store_writes = Counter("turing_store_writes_total",
+                       "Documentos escritos, por acción del juego", ["action"])
+llm_seconds = Histogram("turing_llm_seconds",
+                        "Duración de las llamadas a los modelos", ["provider", "outcome"])
+llm_tokens = Counter("turing_llm_tokens_total",
+                     "Tokens enviados (input) y generados (output) por proveedor", ["provider", "direction"])
+llm_recent_latency = Gauge("turing_llm_recent_latency_seconds",
+                          "Latencia de las últimas respuestas de cada proveedor, por cuantil", ["provider", "quantile"])
+llm_recent_error_rate = Gauge("turing_llm_recent_error_rate",
+                              "Tasa de error de las últimas llamadas de cada proveedor", ["provider"])
+llm_recent_output_tokens = Gauge("turing_llm_recent_output_tokens",
+                                 "Tokens generados por respuesta (media de las últimas)", ["provider"])
+ai_deadline = Counter("turing_ai_deadline_total",
+                      "Respuestas de IA dentro (hit) y fuera (miss) del tiempo máximo", ["result"])
+ai_fallbacks = Counter("turing_ai_fallbacks_total",
+                       "Respuestas de respaldo de los agentes, por motivo", ["reason"])
+ai_queue_depth = Gauge("turing_ai_queue_depth",
+                       "Trabajos de IA encolados o en ejecución")
+
+
+def current_action():
+    """Acción del juego que se está ejecutando en este hilo ('other' fuera de ellas)"""
+    return getattr(_local, 'action', None) or "other"
+
+
+def timed(fn):
+    """Decorador para las acciones del juego: mide su duración y les atribuye
+    las lecturas y escrituras que hagan (la acción más interna gana)"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not METRICS:
+            return fn(*args, **kwargs)
+        previous = getattr(_local, 'action', None)
+        _local.action = name
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            function_seconds.observe(time.perf_counter() - start, function=name)
+            _local.action = previous
+    return wrapper
+
+
+def record_tokens(provider, input_tokens, output_tokens):
+    if input_tokens:
+        llm_tokens.inc(input_tokens, provider=provider, direction="input")
+    if output_tokens:
+        llm_tokens.inc(output_tokens, provider=provider, direction="output")
+
+
+def action_summary():
+    """Por acción del juego: llamadas, latencia media y p95 (ms) y documentos por llamada"""
+    reads = store_reads.values()
+    writes = store_writes.values()
+    rows = []
+    for (name,), entry in sorted(function_seconds.values().items()):
+        calls = entry['count']
+        rows.append({
+            'action': name,
+            'calls': calls,
+            'mean_ms': entry['sum'] / calls * 1000,
+            'p95_ms': function_seconds.quantile(entry, 0.95) * 1000,
+            'reads': reads.get((name,), 0) / calls,
+            'writes': writes.get((name,), 0) / calls
+        })
+    return rows
+
+
+def render():
+    """Todas las métricas en formato de texto de Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.lines())
+    return "\n".join(lines) + "\n"
+
+
+def dump(path):
+    """Escribir las métricas en `path` (se sustituye de una vez, sin lecturas a medias)"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(port=METRICS_PORT, dump_path=METRICS_DUMP, interval=METRICS_DUMP_INTERVAL):
+    """Arrancar el endpoint /metrics y el volcado periódico que estén configurados
+
+    Se llama una vez por proceso; devuelve el servidor HTTP (o None).
+    """
+    server = None
+    if port:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    if dump_path:
+        def dump_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    dump(dump_path)
+                except OSError as e:
+                    print(f"Error al volcar las métricas: {str(e)}")
+        threading.Thread(target=dump_forever, name="metrics-dump", daemon=True).start()
+    return server
@@ -0,0 +1,1285 @@
+"""Backends de almacenamiento para las partidas (Firestore, memoria y SQLite)"""
+import copy
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+
+from firebase_admin import firestore
+
+import metrics
+
+
+class _ServerTimestamp:
+    """Marcador para que el backend ponga la hora del servidor al escribir"""
+    def __repr__(self):
+        return "SERVER_TIMESTAMP"
+
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+class Increment:
+    """Incremento atómico de un campo numérico"""
+    def __init__(self, value):
+        self.value = value
+
+
+def _touch(fields):
+    """Marcar un documento de jugador como modificado (para la sincronización incremental)"""
+    return {**fields, 'updated_at': SERVER_TIMESTAMP}
+
+
+class WriteBatch:
+    """Escrituras agrupadas que se confirman juntas, de forma atómica.
+
+    Se usa como `with store.batch() as batch:`; al salir del bloque sin
+    errores se confirman todas las escrituras en una sola operación.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._ops = []
+
+    def set_game(self, game_id, data):
+        self._ops.append(('set_game', (game_id, data)))
+
+    def update_game(self, game_id, fields):
+        self._ops.append(('update_game', (game_id, fields)))
+
+    def set_player(self, game_id, player_id, data):
+        self._ops.append(('set_player', (game_id, player_id, data)))
+
+    def update_player(self, game_id, player_id, fields):
+        self._ops.append(('update_player', (game_id, player_id, fields)))
+
+    def add_message(self, game_id, message_id, data):
+        self._ops.append(('add_message', (game_id, message_id, data)))
+
+    def update_message(self, game_id, round, message_id, fields):
+        self._ops.append(('update_message', (game_id, round, message_id, fields)))
+
+    def set_round_result(self, game_id, round, data):
+        self._ops.append(('set_round_result', (game_id, round, data)))
+
+    def update_snapshot(self, game_id, fields):
+        self._ops.append(('update_snapshot', (game_id, fields)))
+
+    def commit(self):
+        if self._ops:
+            self._store._commit_batch(self._ops)
+        self._ops = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+
+class Transaction(WriteBatch):
+    """Lecturas y escrituras atómicas (ver GameStore.run_transaction).
+
+    Las lecturas van primero; las escrituras se encolan como en un lote y se
+    confirman juntas al terminar. Si otro cliente cambia lo leído, el backend
+    puede repetir la función, así que no debe tener otros efectos.
+    """
+
+    def __init__(self, store, reader):
+        super().__init__(store)
+        self._reader = reader
+
+    def get_game(self, game_id):
+        return self._reader.get_game(game_id)
+
+    def get_player(self, game_id, player_id):
+        return self._reader.get_player(game_id, player_id)
+
+    def list_players(self, game_id):
+        return self._reader.list_players(game_id)
+
+    def commit(self):
+        raise RuntimeError("Las transacciones se confirman al terminar run_transaction")
+
+
+class GameStore:
+    """Interfaz común de almacenamiento usada por la lógica del juego.
+
+    Los documentos se representan como diccionarios. Las actualizaciones
+    aceptan rutas con puntos ('votes.abc'), `Increment` y `SERVER_TIMESTAMP`.
+    Los jugadores llevan un campo `updated_at` que el backend mantiene en
+    cada escritura.
+    """
+
+    # True si el backend mantiene el documento "snapshot" de cada juego (ver SnapshotStore)
+    snapshots = False
+
+    def get_game(self, game_id):
+        raise NotImplementedError
+
+    def set_game(self, game_id, data):
+        raise NotImplementedError
+
+    def update_game(self, game_id, fields):
+        raise NotImplementedError
+
+    def get_player(self, game_id, player_id):
+        raise NotImplementedError
+
+    def list_players(self, game_id):
+        """Devuelve un diccionario {player_id: datos}"""
+        raise NotImplementedError
+
+    def list_players_since(self, game_id, since):
+        """Jugadores modificados en `since` o después"""
+        raise NotImplementedError
+
+    def set_player(self, game_id, player_id, data):
+        raise NotImplementedError
+
+    def update_player(self, game_id, player_id, fields):
+        raise NotImplementedError
+
+    def add_message(self, game_id, message_id, data):
+        """Guardar un mensaje en su ronda (`data['round']`)"""
+        raise NotImplementedError
+
+    def update_message(self, game_id, round, message_id, fields):
+        raise NotImplementedError
+
+    def list_messages(self, game_id, round):
+        """Mensajes de una ronda ordenados por timestamp"""
+        raise NotImplementedError
+
+    def list_messages_since(self, game_id, round, since):
+        """Mensajes de una ronda con timestamp en `since` o después, ordenados por timestamp"""
+        raise NotImplementedError
+
+    def set_round_result(self, game_id, round, data):
+        raise NotImplementedError
+
+    def list_round_results(self, game_id):
+        raise NotImplementedError
+
+    def get_snapshot(self, game_id):
+        raise NotImplementedError
+
+    def update_snapshot(self, game_id, fields):
+        """Actualizar el snapshot del juego (rutas con puntos); lo crea si no existe"""
+        raise NotImplementedError
+
+    def get_round(self, game_id, round):
+        """Documento de una ronda con datos internos (p. ej. el resumen del contexto), o None"""
+        raise NotImplementedError
+
+    def update_round(self, game_id, round, fields):
+        """Actualizar el documento de una ronda (rutas con puntos); lo crea si no existe
+
+        No forma parte del estado que se muestra, así que no avisa a quien
+        escucha el juego.
+        """
+        raise NotImplementedError
+
+    def watch_game(self, game_id, callback):
+        """Escuchar los cambios de un juego.
+
+        `callback(kind, data)` recibe el estado completo de la parte que cambió:
+        'game' (documento del juego), 'players' ({id: datos}) o 'messages'
+        (lista ordenada de la ronda actual). Se llama una vez por parte al
+        suscribirse. Devuelve una función que cancela la suscripción.
+        """
+        raise NotImplementedError
+
+    def batch(self):
+        """Agrupar escrituras para confirmarlas juntas (ver WriteBatch)"""
+        return WriteBatch(self)
+
+    def _commit_batch(self, ops):
+        raise NotImplementedError
+
+    def run_transaction(self, fn):
+        """Ejecutar `fn(transaction)` de forma atómica y devolver su resultado (ver Transaction)"""
+        raise NotImplementedError
+
+
+# Backend de Firestore
+def _nest(fields):
+    """Convertir rutas con puntos en diccionarios anidados"""
+    nested = {}
+    for key, value in fields.items():
+        path = key.split('.')
+        target = nested
+        for part in path[:-1]:
+            target = target.setdefault(part, {})
+        target[path[-1]] = value
+    return nested
+
+
+def _to_firestore(value):
+    """Convertir los marcadores propios a los de Firestore"""
+    if value is SERVER_TIMESTAMP:
+        return firestore.SERVER_TIMESTAMP
+    if isinstance(value, Increment):
+        return firestore.Increment(value.value)
+    if isinstance(value, dict):
+        return {k: _to_firestore(v) for k, v in value.items()}
+    return value
+
+
+class FirestoreStore(GameStore):
+    """Almacenamiento en Firestore (games/{id} con subcolecciones)"""
+
+    def __init__(self, client):
+        self.db = client
+
+    def _game_ref(self, game_id):
+        return self.db.collection('games').document(game_id)
+
+    def get_game(self, game_id):
+        return self._game_ref(game_id).get().to_dict()
+
+    def set_game(self, game_id, data):
+        self._game_ref(game_id).set(_to_firestore(data))
+
+    def update_game(self, game_id, fields):
+        self._game_ref(game_id).update(_to_firestore(fields))
+
+    def get_player(self, game_id, player_id):
+        return self._game_ref(game_id).collection('players').document(player_id).get().to_dict()
+
+    def list_players(self, game_id):
+        return {p.id: p.to_dict() for p in self._game_ref(game_id).collection('players').get()}
+
+    def list_players_since(self, game_id, since):
+        query = self._game_ref(game_id).collection('players').where('updated_at', '>=', since)
+        return {p.id: p.to_dict() for p in query.get()}
+
+    def set_player(self, game_id, player_id, data):
+        self._game_ref(game_id).collection('players').document(player_id).set(_to_firestore(_touch(data)))
+
+    def update_player(self, game_id, player_id, fields):
+        self._game_ref(game_id).collection('players').document(player_id).update(_to_firestore(_touch(fields)))
+
+    def _messages_ref(self, game_id, round):
+        # Una subcolección por ronda: las consultas solo filtran y ordenan por
+        # timestamp, sin índices compuestos
+        return self._game_ref(game_id).collection('rounds').document(str(round)).collection('messages')
+
+    def add_message(self, game_id, message_id, data):
+        self._messages_ref(game_id, data['round']).document(message_id).set(_to_firestore(data))
+
+    def update_message(self, game_id, round, message_id, fields):
+        self._messages_ref(game_id, round).document(message_id).update(_to_firestore(fields))
+
+    def list_messages(self, game_id, round):
+        query = self._messages_ref(game_id, round).order_by('timestamp')
+        return [{**msg.to_dict(), 'id': msg.id} for msg in query.get()]
+
+    def list_messages_since(self, game_id, round, since):
+        query = (self._messages_ref(game_id, round)
+                 .where('timestamp', '>=', since)
+                 .order_by('timestamp'))
+        return [{**msg.to_dict(), 'id': msg.id} for msg in query.get()]
+
+    def set_round_result(self, game_id, round, data):
+        self._game_ref(game_id).collection('round_results').document(str(round)).set(_to_firestore(data))
+
+    def _snapshot_ref(self, game_id):
+        return self.db.collection('snapshots').document(game_id)
+
+    def get_snapshot(self, game_id):
+        return self._snapshot_ref(game_id).get().to_dict()
+
+    def update_snapshot(self, game_id, fields):
+        # set con merge de rutas concretas: como update, pero crea el documento si falta
+        self._snapshot_ref(game_id).set(_to_firestore(_nest(fields)), merge=list(fields))
+
+    def _round_ref(self, game_id, round):
+        return self._game_ref(game_id).collection('rounds').document(str(round))
+
+    def get_round(self, game_id, round):
+        return self._round_ref(game_id, round).get().to_dict()
+
+    def update_round(self, game_id, round, fields):
+        self._round_ref(game_id, round).set(_to_firestore(_nest(fields)), merge=list(fields))
+
+    def _write_op(self, writer, name, args):
+        """Aplicar una escritura sobre un WriteBatch o una transacción de Firestore"""
+        game_ref = self._game_ref(args[0])
+        if name == 'set_game':
+            writer.set(game_ref, _to_firestore(args[1]))
+        elif name == 'update_game':
+            writer.update(game_ref, _to_firestore(args[1]))
+        elif name == 'set_player':
+            writer.set(game_ref.collection('players').document(args[1]), _to_firestore(_touch(args[2])))
+        elif name == 'update_player':
+            writer.update(game_ref.collection('players').document(args[1]), _to_firestore(_touch(args[2])))
+        elif name == 'add_message':
+            writer.set(self._messages_ref(args[0], args[2]['round']).document(args[1]), _to_firestore(args[2]))
+        elif name == 'update_message':
+            writer.update(self._messages_ref(args[0], args[1]).document(args[2]), _to_firestore(args[3]))
+        elif name == 'set_round_result':
+            writer.set(game_ref.collection('round_results').document(str(args[1])), _to_firestore(args[2]))
+        elif name == 'update_snapshot':
+            writer.set(self._snapshot_ref(args[0]), _to_firestore(_nest(args[1])), merge=list(args[1]))
+        else:
+            raise ValueError(f"Escritura desconocida: {name}")
+
+    def _commit_batch(self, ops):
+        batch = self.db.batch()
+        for name, args in ops:
+            self._write_op(batch, name, args)
+        batch.commit()
+
+    def run_transaction(self, fn):
+        store = self
+
+        class Reader:
+            """Lecturas dentro de la transacción de Firestore"""
+            def __init__(self, transaction):
+                self.transaction = transaction
+
+            def get_game(self, game_id):
+                return store._game_ref(game_id).get(transaction=self.transaction).to_dict()
+
+            def get_player(self, game_id, player_id):
+                ref = store._game_ref(game_id).collection('players').document(player_id)
+                return ref.get(transaction=self.transaction).to_dict()
+
+            def list_players(self, game_id):
+                players = store._game_ref(game_id).collection('players').get(transaction=self.transaction)
+                return {p.id: p.to_dict() for p in players}
+
+        @firestore.transactional
+        def run(firestore_transaction):
+            transaction = Transaction(self, Reader(firestore_transaction))
+            result = fn(transaction)
+            for name, args in transaction._ops:
+                self._write_op(firestore_transaction, name, args)
+            return result
+
+        return run(self.db.transaction())
+
+    def list_round_results(self, game_id):
+        return [r.to_dict() for r in self._game_ref(game_id).collection('round_results').get()]
+
+    def watch_game(self, game_id, callback):
+        game_ref = self._game_ref(game_id)
+        # Suscripción a los mensajes de la ronda actual; cambia con la ronda
+        messages_watch = {'round': None, 'watch': None}
+        lock = threading.Lock()
+
+        def on_messages(docs, changes, read_time):
+            callback('messages', [{**msg.to_dict(), 'id': msg.id} for msg in docs])
+
+        def on_game(docs, changes, read_time):
+            game = docs[0].to_dict() if docs and docs[0].exists else None
+            callback('game', game)
+            current_round = (game or {}).get('current_round', 0)
+            with lock:
+                if current_round == messages_watch['round']:
+                    return
+                if messages_watch['watch']:
+                    messages_watch['watch'].unsubscribe()
+                messages_watch['round'] = current_round
+                messages_watch['watch'] = (self._messages_ref(game_id, current_round)
+                                           .order_by('timestamp').on_snapshot(on_messages))
+
+        watches = [
+            game_ref.on_snapshot(on_game),
+            game_ref.collection('players').on_snapshot(lambda docs, changes, read_time: callback(
+                'players', {p.id: p.to_dict() for p in docs}))
+        ]
+
+        def unsubscribe():
+            for watch in watches:
+                watch.unsubscribe()
+            with lock:
+                if messages_watch['watch']:
+                    messages_watch['watch'].unsubscribe()
+
+        return unsubscribe
+
+
+# Utilidades comunes para los backends locales
+class _Clock:
+    """Hora del "servidor" estrictamente creciente para ordenar mensajes"""
+
+    def __init__(self):
+        self._last = None
+
+    def now(self):
+        now = datetime.now(timezone.utc)
+        if self._last is not None and now <= self._last:
+            now = self._last + timedelta(microseconds=1)
+        self._last = now
+        return now
+
+
+class _LocalWatchers:
+    """Avisos de cambios dentro del proceso para los backends locales"""
+
+    def _init_watchers(self):
+        self._watchers = {}
+        self._watchers_lock = threading.Lock()
+        self._deferred = threading.local()
+
+    def watch_game(self, game_id, callback):
+        with self._watchers_lock:
+            self._watchers.setdefault(game_id, []).append(callback)
+        for kind in ('game', 'players', 'messages'):
+            callback(kind, self._watched_data(game_id, kind))
+
+        def unsubscribe():
+            with self._watchers_lock:
+                callbacks = self._watchers.get(game_id, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+
+        return unsubscribe
+
+    def _watched_data(self, game_id, kind):
+        if kind == 'game':
+            return self.get_game(game_id)
+        if kind == 'players':
+            return self.list_players(game_id)
+        game = self.get_game(game_id) or {}
+        return self.list_messages(game_id, game.get('current_round', 0))
+
+    def _notify(self, game_id, kind):
+        """Avisar a los suscriptores; se llama después de cada escritura"""
+        pending = getattr(self._deferred, 'pending', None)
+        if pending is not None:
+            # Dentro de un lote se avisa una sola vez al confirmar
+            pending.add((game_id, kind))
+            return
+        with self._watchers_lock:
+            callbacks = list(self._watchers.get(game_id, []))
+        # Un cambio del juego puede ser un cambio de ronda: enviar también sus mensajes
+        for changed in (('game', 'messages') if kind == 'game' else (kind,)):
+            if callbacks:
+                data = self._watched_data(game_id, changed)
+                for callback in callbacks:
+                    callback(changed, data)
+
+    @contextmanager
+    def _deferred_notifications(self):
+        self._deferred.pending = set()
+        try:
+            yield
+        finally:
+            pending, self._deferred.pending = self._deferred.pending, None
+        for game_id, kind in sorted(pending):
+            self._notify(game_id, kind)
+
+    def _commit_batch(self, ops):
+        with self._deferred_notifications():
+            self._apply_ops(ops)
+
+    def _apply_ops(self, ops):
+        # Se aplica todo con el candado tomado: los lectores ven el lote completo o nada
+        game_ids = {args[0] for name, args in ops}
+        with self._lock, self._transaction(game_ids):
+            for name, args in ops:
+                getattr(self, name)(*args)
+
+    def run_transaction(self, fn):
+        # El candado (y en SQLite, BEGIN IMMEDIATE) cubre las lecturas y las escrituras
+        with self._deferred_notifications():
+            with self._lock, self._transaction(()):
+                transaction = Transaction(self, self)
+                result = fn(transaction)
+                self._apply_ops(transaction._ops)
+        return result
+
+
+def _resolve(value, now):
+    """Sustituir los marcadores en un documento nuevo"""
+    if value is SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, Increment):
+        return value.value
+    if isinstance(value, dict):
+        return {k: _resolve(v, now) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+def _apply_update(doc, fields, now, undo=None):
+    """Aplicar una actualización (con rutas de puntos) sobre un documento
+
+    Con `undo` se anota en esa lista el valor anterior de cada campo que cambia.
+    """
+    for key, value in fields.items():
+        path = key.split('.')
+        target = doc
+        for part in path[:-1]:
+            if not isinstance(target.get(part), dict):
+                _set_item(target, part, {}, undo)
+            target = target[part]
+        if isinstance(value, Increment):
+            _set_item(target, path[-1], (target.get(path[-1]) or 0) + value.value, undo)
+        else:
+            _set_item(target, path[-1], _resolve(value, now), undo)
+    return doc
+
+
+# Valor anotado para una clave que no existía
+_MISSING = object()
+
+
+def _set_item(container, key, value, undo=None):
+    """`container[key] = value`, anotando antes el valor anterior en `undo`"""
+    if undo is not None:
+        undo.append((container, key, container.get(key, _MISSING)))
+    container[key] = value
+
+
+class MemoryStore(_LocalWatchers, GameStore):
+    """Almacenamiento en memoria del proceso, para pruebas de carga y un solo nodo"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clock = _Clock()
+        self._games = {}
+        # Valores anteriores de lo que cambia el lote en curso (ver _transaction)
+        self._undo = None
+        self._init_watchers()
+
+    @contextmanager
+    def _transaction(self, game_ids=()):
+        """Deshacer los cambios si algo falla a mitad de un lote
+
+        Cada escritura anota solo lo que toca (un documento, un campo o un
+        mensaje añadido), no se copia el juego entero. Se llama con el candado
+        tomado; si ya hay un lote abierto, sus cambios se deshacen con él.
+        """
+        if self._undo is not None:
+            yield
+            return
+        self._undo = []
+        try:
+            yield
+        except Exception:
+            for entry in reversed(self._undo):
+                if callable(entry):
+                    entry()
+                    continue
+                container, key, previous = entry
+                if previous is _MISSING:
+                    container.pop(key, None)
+                else:
+                    container[key] = previous
+            raise
+        finally:
+            self._undo = None
+
+    def _game(self, game_id):
+        if game_id not in self._games:
+            _set_item(self._games, game_id, {'data': None, 'players': {}, 'rounds': {}, 'round_results': {},
+                                             'snapshot': None}, self._undo)
+        return self._games[game_id]
+
+    def get_game(self, game_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            return copy.deepcopy(game['data']) if game else None
+
+    def set_game(self, game_id, data):
+        with self._lock:
+            _set_item(self._game(game_id), 'data', _resolve(data, self._clock.now()), self._undo)
+        self._notify(game_id, 'game')
+
+    def update_game(self, game_id, fields):
+        with self._lock:
+            game = self._games.get(game_id)
+            if not game or game['data'] is None:
+                raise KeyError(f"No existe el juego {game_id}")
+            _apply_update(game['data'], fields, self._clock.now(), self._undo)
+        self._notify(game_id, 'game')
+
+    def get_player(self, game_id, player_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            player = game['players'].get(player_id) if game else None
+            return copy.deepcopy(player)
+
+    def list_players(self, game_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            return copy.deepcopy(game['players']) if game else {}
+
+    def list_players_since(self, game_id, since):
+        with self._lock:
+            game = self._games.get(game_id)
+            if not game:
+                return {}
+            return {player_id: copy.deepcopy(player) for player_id, player in game['players'].items()
+                    if player['updated_at'] >= since}
+
+    def set_player(self, game_id, player_id, data):
+        with self._lock:
+            player = _resolve(_touch(data), self._clock.now())
+            _set_item(self._game(game_id)['players'], player_id, player, self._undo)
+        self._notify(game_id, 'players')
+
+    def update_player(self, game_id, player_id, fields):
+        with self._lock:
+            game = self._games.get(game_id)
+            if not game or player_id not in game['players']:
+                raise KeyError(f"No existe el jugador {player_id}")
+            _apply_update(game['players'][player_id], _touch(fields), self._clock.now(), self._undo)
+        self._notify(game_id, 'players')
+
+    def _round(self, game_id, round):
+        """Mensajes de una ronda: {'messages': [...], 'index': {id: mensaje}} (y su documento en 'data')"""
+        rounds = self._game(game_id)['rounds']
+        if str(round) not in rounds:
+            _set_item(rounds, str(round), {'messages': [], 'index': {}}, self._undo)
+        return rounds[str(round)]
+
+    def _round_messages(self, game_id, round):
+        game = self._games.get(game_id)
+        messages = game['rounds'].get(str(round)) if game else None
+        return messages['messages'] if messages else []
+
+    def add_message(self, game_id, message_id, data):
+        with self._lock:
+            message = _resolve(data, self._clock.now())
+            message['id'] = message_id
+            messages = self._round(game_id, data['round'])
+            replaced = messages['index'].get(message_id)
+            position = None
+            if replaced is not None:
+                position = next(i for i, msg in enumerate(messages['messages']) if msg is replaced)
+                del messages['messages'][position]
+            messages['messages'].append(message)
+            if self._undo is not None:
+                # Se deshace quitando el mensaje añadido (el último) y devolviendo el sustituido
+                self._undo.append(lambda: self._unappend_message(messages, position, replaced))
+            _set_item(messages['index'], message_id, message, self._undo)
+        self._notify(game_id, 'messages')
+
+    @staticmethod
+    def _unappend_message(messages, position, replaced):
+        messages['messages'].pop()
+        if replaced is not None:
+            messages['messages'].insert(position, replaced)
+
+    def update_message(self, game_id, round, message_id, fields):
+        with self._lock:
+            game = self._games.get(game_id)
+            messages = game['rounds'].get(str(round)) if game else None
+            if not messages or message_id not in messages['index']:
+                raise KeyError(f"No existe el mensaje {message_id}")
+            _apply_update(messages['index'][message_id], fields, self._clock.now(), self._undo)
+        self._notify(game_id, 'messages')
+
+    def list_messages(self, game_id, round):
+        with self._lock:
+            # Los mensajes se guardan en orden de llegada, que coincide con su timestamp
+            return copy.deepcopy(self._round_messages(game_id, round))
+
+    def list_messages_since(self, game_id, round, since):
+        with self._lock:
+            return [copy.deepcopy(msg) for msg in self._round_messages(game_id, round)
+                    if msg['timestamp'] >= since]
+
+    def set_round_result(self, game_id, round, data):
+        with self._lock:
+            _set_item(self._game(game_id)['round_results'], str(round), _resolve(data, self._clock.now()),
+                      self._undo)
+
+    def list_round_results(self, game_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            return copy.deepcopy(list(game['round_results'].values())) if game else []
+
+    def get_snapshot(self, game_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            return copy.deepcopy(game['snapshot']) if game else None
+
+    def update_snapshot(self, game_id, fields):
+        with self._lock:
+            game = self._game(game_id)
+            if game['snapshot'] is None:
+                _set_item(game, 'snapshot', {}, self._undo)
+            _apply_update(game['snapshot'], fields, self._clock.now(), self._undo)
+
+    def get_round(self, game_id, round):
+        with self._lock:
+            game = self._games.get(game_id)
+            round_data = game['rounds'].get(str(round)) if game else None
+            return copy.deepcopy(round_data.get('data')) if round_data else None
+
+    def update_round(self, game_id, round, fields):
+        with self._lock:
+            round_data = self._round(game_id, round)
+            if round_data.get('data') is None:
+                _set_item(round_data, 'data', {}, self._undo)
+            _apply_update(round_data['data'], fields, self._clock.now(), self._undo)
+
+
+# Backend de SQLite
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {'$ts': value.isoformat()}
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _json_hook(obj):
+    if len(obj) == 1 and '$ts' in obj:
+        return datetime.fromisoformat(obj['$ts'])
+    return obj
+
+
+def _dumps(data):
+    return json.dumps(data, default=_json_default)
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_json_hook) if text is not None else None
+
+
+class SQLiteStore(_LocalWatchers, GameStore):
+    """Almacenamiento en un archivo SQLite en modo WAL
+
+    Los avisos de `watch_game` solo cubren las escrituras de este proceso.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS games (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS players (
+        game_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (game_id, id)
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        game_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        round INTEGER,
+        ts TEXT NOT NULL,
+        data TEXT NOT NULL,
+        UNIQUE (game_id, id)
+    );
+    CREATE INDEX IF NOT EXISTS messages_by_round ON messages (game_id, round, ts, seq);
+    CREATE TABLE IF NOT EXISTS round_results (
+        game_id TEXT NOT NULL,
+        round TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (game_id, round)
+    );
+    CREATE TABLE IF NOT EXISTS snapshots (
+        game_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rounds (
+        game_id TEXT NOT NULL,
+        round TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (game_id, round)
+    );
+    """
+
+    def __init__(self, path="turing_games.db"):
+        self._lock = threading.RLock()
+        self._clock = _Clock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._init_watchers()
+
+    def _read(self, sql, params):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    @contextmanager
+    def _transaction(self, game_ids=()):
+        """Transacción de SQLite; si ya hay una abierta se reutiliza"""
+        with self._lock:
+            if self._conn.in_transaction:
+                yield
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _update(self, table, key_sql, key_params, fields):
+        """Leer, modificar y escribir un documento dentro de una transacción"""
+        with self._transaction():
+            row = self._conn.execute(f"SELECT data FROM {table} WHERE {key_sql}", key_params).fetchone()
+            if row is None:
+                raise KeyError(f"No existe el documento {key_params}")
+            doc = _apply_update(_loads(row[0]), fields, self._clock.now())
+            if table == 'players':
+                self._conn.execute(f"UPDATE players SET data = ?, updated_at = ? WHERE {key_sql}",
+                                   (_dumps(doc), doc['updated_at'].isoformat(), *key_params))
+            else:
+                self._conn.execute(f"UPDATE {table} SET data = ? WHERE {key_sql}", (_dumps(doc), *key_params))
+
+    def get_game(self, game_id):
+        rows = self._read("SELECT data FROM games WHERE id = ?", (game_id,))
+        return _loads(rows[0][0]) if rows else None
+
+    def set_game(self, game_id, data):
+        # La hora se toma con el candado: el reloj no es seguro entre hilos
+        with self._lock:
+            self._write("INSERT OR REPLACE INTO games (id, data) VALUES (?, ?)",
+                        (game_id, _dumps(_resolve(data, self._clock.now()))))
+        self._notify(game_id, 'game')
+
+    def update_game(self, game_id, fields):
+        self._update('games', "id = ?", (game_id,), fields)
+        self._notify(game_id, 'game')
+
+    def get_player(self, game_id, player_id):
+        rows = self._read("SELECT data FROM players WHERE game_id = ? AND id = ?", (game_id, player_id))
+        return _loads(rows[0][0]) if rows else None
+
+    def list_players(self, game_id):
+        rows = self._read("SELECT id, data FROM players WHERE game_id = ?", (game_id,))
+        return {player_id: _loads(data) for player_id, data in rows}
+
+    def list_players_since(self, game_id, since):
+        rows = self._read("SELECT id, data FROM players WHERE game_id = ? AND updated_at >= ?",
+                          (game_id, since.isoformat()))
+        return {player_id: _loads(data) for player_id, data in rows}
+
+    def set_player(self, game_id, player_id, data):
+        with self._lock:
+            player = _resolve(_touch(data), self._clock.now())
+            self._write("INSERT OR REPLACE INTO players (game_id, id, updated_at, data) VALUES (?, ?, ?, ?)",
+                        (game_id, player_id, player['updated_at'].isoformat(), _dumps(player)))
+        self._notify(game_id, 'players')
+
+    def update_player(self, game_id, player_id, fields):
+        self._update('players', "game_id = ? AND id = ?", (game_id, player_id), _touch(fields))
+        self._notify(game_id, 'players')
+
+    def add_message(self, game_id, message_id, data):
+        with self._lock:
+            now = self._clock.now()
+            message = _resolve(data, now)
+            message['id'] = message_id
+            timestamp = message.get('timestamp')
+            ts = timestamp.isoformat() if isinstance(timestamp, datetime) else now.isoformat()
+            self._write("INSERT OR REPLACE INTO messages (game_id, id, round, ts, data) VALUES (?, ?, ?, ?, ?)",
+                        (game_id, message_id, message.get('round'), ts, _dumps(message)))
+        self._notify(game_id, 'messages')
+
+    def update_message(self, game_id, round, message_id, fields):
+        self._update('messages', "game_id = ? AND id = ?", (game_id, message_id), fields)
+        self._notify(game_id, 'messages')
+
+    def list_messages(self, game_id, round):
+        rows = self._read("SELECT data FROM messages WHERE game_id = ? AND round = ? ORDER BY ts, seq",
+                          (game_id, round))
+        return [_loads(data) for (data,) in rows]
+
+    def list_messages_since(self, game_id, round, since):
+        rows = self._read("SELECT data FROM messages WHERE game_id = ? AND round = ? AND ts >= ? ORDER BY ts, seq",
+                          (game_id, round, since.isoformat()))
+        return [_loads(data) for (data,) in rows]
+
+    def set_round_result(self, game_id, round, data):
+        with self._lock:
+            self._write("INSERT OR REPLACE INTO round_results (game_id, round, data) VALUES (?, ?, ?)",
+                        (game_id, str(round), _dumps(_resolve(data, self._clock.now()))))
+
+    def list_round_results(self, game_id):
+        rows = self._read("SELECT data FROM round_results WHERE game_id = ?", (game_id,))
+        return [_loads(data) for (data,) in rows]
+
+    def get_snapshot(self, game_id):
+        rows = self._read("SELECT data FROM snapshots WHERE game_id = ?", (game_id,))
+        return _loads(rows[0][0]) if rows else None
+
+    def update_snapshot(self, game_id, fields):
+        with self._transaction():
+            row = self._conn.execute("SELECT data FROM snapshots WHERE game_id = ?", (game_id,)).fetchone()
+            snapshot = _apply_update(_loads(row[0]) if row else {}, fields, self._clock.now())
+            self._conn.execute("INSERT OR REPLACE INTO snapshots (game_id, data) VALUES (?, ?)",
+                               (game_id, _dumps(snapshot)))
+
+    def get_round(self, game_id, round):
+        rows = self._read("SELECT data FROM rounds WHERE game_id = ? AND round = ?", (game_id, str(round)))
+        return _loads(rows[0][0]) if rows else None
+
+    def update_round(self, game_id, round, fields):
+        with self._transaction():
+            row = self._conn.execute("SELECT data FROM rounds WHERE game_id = ? AND round = ?",
+                                     (game_id, str(round))).fetchone()
+            round_data = _apply_update(_loads(row[0]) if row else {}, fields, self._clock.now())
+            self._conn.execute("INSERT OR REPLACE INTO rounds (game_id, round, data) VALUES (?, ?, ?)",
+                               (game_id, str(round), _dumps(round_data)))
+
+
+class StoreWrapper(GameStore):
+    """Backend que delega en otro; base para añadir comportamiento a sus escrituras"""
+
+    def __init__(self, store):
+        self.store = store
+        self.snapshots = store.snapshots
+
+    def get_game(self, game_id):
+        return self.store.get_game(game_id)
+
+    def set_game(self, game_id, data):
+        self.store.set_game(game_id, data)
+
+    def update_game(self, game_id, fields):
+        self.store.update_game(game_id, fields)
+
+    def get_player(self, game_id, player_id):
+        return self.store.get_player(game_id, player_id)
+
+    def list_players(self, game_id):
+        return self.store.list_players(game_id)
+
+    def list_players_since(self, game_id, since):
+        return self.store.list_players_since(game_id, since)
+
+    def set_player(self, game_id, player_id, data):
+        self.store.set_player(game_id, player_id, data)
+
+    def update_player(self, game_id, player_id, fields):
+        self.store.update_player(game_id, player_id, fields)
+
+    def add_message(self, game_id, message_id, data):
+        self.store.add_message(game_id, message_id, data)
+
+    def update_message(self, game_id, round, message_id, fields):
+        self.store.update_message(game_id, round, message_id, fields)
+
+    def list_messages(self, game_id, round):
+        return self.store.list_messages(game_id, round)
+
+    def list_messages_since(self, game_id, round, since):
+        return self.store.list_messages_since(game_id, round, since)
+
+    def set_round_result(self, game_id, round, data):
+        self.store.set_round_result(game_id, round, data)
+
+    def list_round_results(self, game_id):
+        return self.store.list_round_results(game_id)
+
+    def get_snapshot(self, game_id):
+        return self.store.get_snapshot(game_id)
+
+    def update_snapshot(self, game_id, fields):
+        self.store.update_snapshot(game_id, fields)
+
+    def get_round(self, game_id, round):
+        return self.store.get_round(game_id, round)
+
+    def update_round(self, game_id, round, fields):
+        self.store.update_round(game_id, round, fields)
+
+    def watch_game(self, game_id, callback):
+        return self.store.watch_game(game_id, callback)
+
+    def _commit_batch(self, ops):
+        self.store._commit_batch(ops)
+
+    def run_transaction(self, fn):
+        return self.store.run_transaction(fn)
+
+
+class SnapshotStore(StoreWrapper):
+    """Backend que mantiene, junto a cada juego, un documento "snapshot" con
+    todo lo que dibuja la pantalla: el juego, una lista compacta de jugadores
+    y los mensajes de la ronda actual (por id, para poder actualizarlos).
+
+    Cada escritura se confirma junto con su actualización del snapshot, así
+    una pantalla se puede dibujar con una sola lectura (ver get_snapshot).
+    """
+
+    # Campos del juego que no se copian al snapshot (resúmenes de juegos antiguos)
+    GAME_EXCLUDED = ('summaries',)
+    # Campos de cada jugador que se copian al snapshot
+    ROSTER_FIELDS = ('name', 'is_ai', 'ai_type', 'messages_sent', 'score', 'revealed')
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.snapshots = True
+
+    # Cada escritura va en un lote con su actualización del snapshot
+    def set_game(self, game_id, data):
+        self._commit_batch([('set_game', (game_id, data))])
+
+    def update_game(self, game_id, fields):
+        self._commit_batch([('update_game', (game_id, fields))])
+
+    def set_player(self, game_id, player_id, data):
+        self._commit_batch([('set_player', (game_id, player_id, data))])
+
+    def update_player(self, game_id, player_id, fields):
+        self._commit_batch([('update_player', (game_id, player_id, fields))])
+
+    def add_message(self, game_id, message_id, data):
+        self._commit_batch([('add_message', (game_id, message_id, data))])
+
+    def update_message(self, game_id, round, message_id, fields):
+        self._commit_batch([('update_message', (game_id, round, message_id, fields))])
+
+    def _commit_batch(self, ops):
+        self.store._commit_batch(self._with_snapshot(ops))
+
+    def run_transaction(self, fn):
+        def mirrored(transaction):
+            result = fn(transaction)
+            transaction._ops = self._with_snapshot(transaction._ops)
+            return result
+        return self.store.run_transaction(mirrored)
+
+    def _with_snapshot(self, ops):
+        """Añadir a cada escritura la actualización equivalente del snapshot"""
+        mirrored = []
+        for name, args in ops:
+            mirrored.append((name, args))
+            fields = self._snapshot_fields(name, args)
+            if fields:
+                mirrored.append(('update_snapshot', (args[0], fields)))
+        return mirrored
+
+    def _snapshot_fields(self, name, args):
+        if name == 'set_game':
+            game = {k: v for k, v in args[1].items() if k not in self.GAME_EXCLUDED}
+            # `seeded` marca un snapshot completo: los de juegos creados antes de
+            # activar los snapshots solo tienen los campos escritos desde entonces
+            return {'game': game, 'players': {}, 'messages': {}, 'seeded': True}
+        if name == 'update_game':
+            fields = {f'game.{k}': v for k, v in args[1].items()
+                      if k.split('.')[0] not in self.GAME_EXCLUDED}
+            if 'current_round' in args[1]:
+                # Ronda nueva: solo se guardan sus mensajes
+                fields['messages'] = {}
+            return fields
+        if name == 'set_player':
+            roster = {k: v for k, v in args[2].items() if k in self.ROSTER_FIELDS}
+            roster['voted'] = bool(args[2].get('votes'))
+            return {f'players.{args[1]}': roster}
+        if name == 'update_player':
+            fields = {}
+            for key, value in args[2].items():
+                base = key.split('.')[0]
+                if base in self.ROSTER_FIELDS:
+                    fields[f'players.{args[1]}.{key}'] = value
+                elif base == 'votes':
+                    fields[f'players.{args[1]}.voted'] = key != 'votes' or bool(value)
+            return fields
+        if name == 'add_message':
+            return {f'messages.{args[1]}': {**args[2], 'id': args[1]}}
+        if name == 'update_message':
+            return {f'messages.{args[2]}.{k}': v for k, v in args[3].items()}
+        return None
+
+
+class ObservedStore(StoreWrapper):
+    """Backend que llama a `on_write(game_id)` después de cada escritura de este proceso"""
+
+    def __init__(self, store, on_write):
+        super().__init__(store)
+        self.on_write = on_write
+
+    def set_game(self, game_id, data):
+        super().set_game(game_id, data)
+        self.on_write(game_id)
+
+    def update_game(self, game_id, fields):
+        super().update_game(game_id, fields)
+        self.on_write(game_id)
+
+    def set_player(self, game_id, player_id, data):
+        super().set_player(game_id, player_id, data)
+        self.on_write(game_id)
+
+    def update_player(self, game_id, player_id, fields):
+        super().update_player(game_id, player_id, fields)
+        self.on_write(game_id)
+
+    def add_message(self, game_id, message_id, data):
+        super().add_message(game_id, message_id, data)
+        self.on_write(game_id)
+
+    def update_message(self, game_id, round, message_id, fields):
+        super().update_message(game_id, round, message_id, fields)
+        self.on_write(game_id)
+
+    def set_round_result(self, game_id, round, data):
+        super().set_round_result(game_id, round, data)
+        self.on_write(game_id)
+
+    def _commit_batch(self, ops):
+        super()._commit_batch(ops)
+        for game_id in {args[0] for name, args in ops}:
+            self.on_write(game_id)
+
+    def run_transaction(self, fn):
+        written = set()
+
+        def observed(transaction):
+            result = fn(transaction)
+            written.update(args[0] for name, args in transaction._ops)
+            return result
+
+        result = super().run_transaction(observed)
+        for game_id in written:
+            self.on_write(game_id)
+        return result
+
+
+class _InstrumentedReader:
+    """Lecturas de una transacción contadas por InstrumentedStore"""
+
+    def __init__(self, store, reader):
+        self.store = store
+        self.reader = reader
+
+    def get_game(self, game_id):
+        self.store._count('reads')
+        return self.reader.get_game(game_id)
+
+    def get_player(self, game_id, player_id):
+        self.store._count('reads')
+        return self.reader.get_player(game_id, player_id)
+
+    def list_players(self, game_id):
+        players = self.reader.list_players(game_id)
+        self.store._count('reads', max(1, len(players)))
+        return players
+
+
+class InstrumentedStore(StoreWrapper):
+    """Backend que mide cada llamada y cuenta los documentos leídos y escritos
+
+    Se cuenta como factura Firestore: una consulta lee un documento por
+    resultado (mínimo uno) y cada escritura de un lote o transacción cuenta por
+    separado. Los documentos se atribuyen a la acción del juego en curso (ver
+    metrics.timed).
+    """
+
+    def _count(self, kind, n=1):
+        counter = metrics.store_reads if kind == 'reads' else metrics.store_writes
+        counter.inc(n, action=metrics.current_action())
+
+    def _call(self, method, *args):
+        with metrics.store_seconds.time(method=method.lstrip('_')):
+            return getattr(self.store, method)(*args)
+
+    def _read(self, method, *args):
+        result = self._call(method, *args)
+        self._count('reads', max(1, len(result)) if method.startswith('list_') else 1)
+        return result
+
+    def _write(self, method, *args):
+        self._call(method, *args)
+        self._count('writes')
+
+    def get_game(self, game_id):
+        return self._read('get_game', game_id)
+
+    def set_game(self, game_id, data):
+        self._write('set_game', game_id, data)
+
+    def update_game(self, game_id, fields):
+        self._write('update_game', game_id, fields)
+
+    def get_player(self, game_id, player_id):
+        return self._read('get_player', game_id, player_id)
+
+    def list_players(self, game_id):
+        return self._read('list_players', game_id)
+
+    def list_players_since(self, game_id, since):
+        return self._read('list_players_since', game_id, since)
+
+    def set_player(self, game_id, player_id, data):
+        self._write('set_player', game_id, player_id, data)
+
+    def update_player(self, game_id, player_id, fields):
+        self._write('update_player', game_id, player_id, fields)
+
+    def add_message(self, game_id, message_id, data):
+        self._write('add_message', game_id, message_id, data)
+
+    def update_message(self, game_id, round, message_id, fields):
+        self._write('update_message', game_id, round, message_id, fields)
+
+    def list_messages(self, game_id, round):
+        return self._read('list_messages', game_id, round)
+
+    def list_messages_since(self, game_id, round, since):
+        return self._read('list_messages_since', game_id, round, since)
+
+    def set_round_result(self, game_id, round, data):
+        self._write('set_round_result', game_id, round, data)
+
+    def list_round_results(self, game_id):
+        return self._read('list_round_results', game_id)
+
+    def get_snapshot(self, game_id):
+        return self._read('get_snapshot', game_id)
+
+    def update_snapshot(self, game_id, fields):
+        self._write('update_snapshot', game_id, fields)
+
+    def get_round(self, game_id, round):
+        return self._read('get_round', game_id, round)
+
+    def update_round(self, game_id, round, fields):
+        self._write('update_round', game_id, round, fields)
+
+    def _commit_batch(self, ops):
+        self._call('_commit_batch', ops)
+        self._count('writes', len(ops))
+
+    def run_transaction(self, fn):
+        attempt = {}
+
+        def instrumented(transaction):
+            # Las lecturas cuentan en cada intento; las escrituras solo las del que se confirma
+            transaction._reader = _InstrumentedReader(self, transaction._reader)
+            attempt['transaction'] = transaction
+            return fn(transaction)
+
+        result = self._call('run_transaction', instrumented)
+        self._count('writes', len(attempt['transaction']._ops))
+        return result
+
+
+def create_store(kind, **options):
+    """Crear un backend por nombre: 'firestore', 'memory' o 'sqlite'
+
+    Con `snapshots=True` el backend mantiene además el snapshot de cada juego y
+    con `instrumented=True` sus llamadas se miden (ver InstrumentedStore).
+    """
+    if kind == "firestore":
+        store = FirestoreStore(options.get('client') or firestore.client())
+    elif kind == "memory":
+        store = MemoryStore()
+    elif kind == "sqlite":
+        store = SQLiteStore(options.get('path', "turing_games.db"))
+    else:
+        raise ValueError(f"Backend de almacenamiento desconocido: {kind}")
+    if options.get('instrumented'):
+        # Debajo del snapshot, para contar también sus escrituras
+        store = InstrumentedStore(store)
+    return SnapshotStore(store) if options.get('snapshots') else store
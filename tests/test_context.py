@@ -0,0 +1,24 @@
+"""Pruebas del contexto de conversación de los agentes"""
+import context
+from storage import MemoryStore
+
+
+def messages(count):
+    return [{'id': str(i), 'player_name': "Ana", 'content': f"mensaje número {i} " * 5} for i in range(count)]
+
+
+def test_summarized_messages_do_not_return_to_recent_window(monkeypatch):
+    store = MemoryStore()
+    round_messages = messages(10)
+
+    # Con poco presupuesto casi toda la ronda pasa al resumen
+    monkeypatch.setattr(context, 'CONTEXT_TOKEN_BUDGET', 60)
+    context.build_context(store, 'g', 1, round_messages)
+    covered = store.get_round('g', 1)['summary']['count']
+
+    # Aunque el punto de corte retroceda, la ventana reciente empieza después del resumen
+    monkeypatch.setattr(context, 'CONTEXT_TOKEN_BUDGET', 600)
+    summary, recent = context.build_context(store, 'g', 1, round_messages)
+
+    assert [msg['id'] for msg in recent] == [msg['id'] for msg in round_messages[covered:]]
+    assert len(summary.splitlines()) == covered
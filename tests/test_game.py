@@ -0,0 +1,75 @@
+"""Pruebas de la lógica del juego contra el backend en memoria"""
+import os
+
+# Los agentes IA responden en el mismo hilo, sin la cola de trabajos
+os.environ.setdefault("AI_WORKERS", "0")
+
+import pytest
+
+import game
+from storage import MemoryStore
+
+
+@pytest.fixture
+def store():
+    memory = MemoryStore()
+    game.configure_store(memory)
+    return memory
+
+
+def legacy_lobby(store, game_id, humans):
+    """Sala creada antes de existir los contadores de jugadores (sin human_count ni ai_count)"""
+    store.set_game(game_id, {
+        'status': 'waiting',
+        'current_round': 0,
+        'max_rounds': 1,
+        'messages_per_player': 5,
+        'host': "Jugador 0",
+        'settings': {'max_players': 4, 'ai_players': 2, 'human_players': 2}
+    })
+    for i in range(humans):
+        store.set_player(game_id, f"legacy-{i}", {
+            'name': f"Jugador {i}", 'is_ai': False, 'messages_sent': 0, 'votes': {}, 'score': 0
+        })
+
+
+def test_join_legacy_lobby_counts_existing_players(store):
+    legacy_lobby(store, 'legacy', humans=1)
+
+    ok, _ = game.create_or_join_game('legacy', "Bea")
+
+    assert ok
+    game_data = store.get_game('legacy')
+    assert (game_data['human_count'], game_data['ai_count']) == (2, 0)
+    assert game.start_game('legacy')[0]
+
+
+def test_full_legacy_lobby_rejects_new_humans(store):
+    legacy_lobby(store, 'legacy', humans=2)
+
+    ok, message = game.create_or_join_game('legacy', "Carla")
+
+    assert not ok
+    assert "lleno" in message
+    assert len(store.list_players('legacy')) == 2
+    assert game.start_game('legacy')[0]
+
+
+def test_message_of_legacy_player_goes_to_current_round(store):
+    store.set_game('legacy', {
+        'status': 'playing',
+        'current_round': 2,
+        'max_rounds': 3,
+        'messages_per_player': 5,
+        'human_count': 1,
+        'ai_count': 0,
+        'settings': {'max_players': 1, 'ai_players': 0, 'human_players': 1}
+    })
+    # Jugador guardado antes de existir el campo `round`
+    store.set_player('legacy', 'ana', {'name': "Ana", 'is_ai': False, 'messages_sent': 0, 'votes': {}, 'score': 0})
+
+    ok, _ = game.send_message('legacy', 'ana', "Hola")
+
+    assert ok
+    assert [msg['round'] for msg in store.list_messages('legacy', 2)] == [2]
+    assert [msg['content'] for msg in game.get_game_state('legacy')['messages']] == ["Hola"]
@@ -0,0 +1,66 @@
+"""Cola de trabajos en segundo plano para las respuestas de los agentes IA"""
+import os
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+# Número de hilos para generar respuestas de IA (0 = ejecutar en el mismo hilo)
+AI_WORKERS = int(os.getenv("AI_WORKERS", "8"))
+
+
+class JobQueue:
+    """Pool acotado de hilos que consume trabajos sin bloquear a quien los envía"""
+
+    def __init__(self, max_workers, name="ai-worker"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name) if max_workers > 0 else None
+        self._idle = threading.Condition()
+        self._pending = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Encolar un trabajo; los errores se registran en lugar de perderse"""
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                print(f"Error en trabajo de IA: {str(e)}")
+                future.set_exception(e)
+            return future
+
+        with self._idle:
+            self._pending += 1
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def _run(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            print(f"Error en trabajo de IA: {str(e)}")
+            traceback.print_exc()
+            raise
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def pending(self):
+        """Trabajos encolados o en ejecución"""
+        with self._idle:
+            return self._pending
+
+    def wait_idle(self, timeout=None):
+        """Esperar a que no queden trabajos pendientes; devuelve False si se agota el tiempo"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+# Cola compartida por todo el proceso
+ai_jobs = JobQueue(AI_WORKERS)
+metrics.ai_queue_depth.set_function(ai_jobs.pending)